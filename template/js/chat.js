@@ -32,8 +32,11 @@ function NewChat() {
 	xhr.onload = function() {
 		if (xhr.status === 200) {
 			// Request successful, add the message to the chat
-			var timestamp = new Date().toLocaleString(); // You might want to get this from the server response
-			var addMessageToChatResult = AddMessageToChat(author, timestamp, message);
+			// (when the message stream is connected, the server sends it back and it is added there)
+			if (!window.messageStream) {
+				var timestamp = new Date().toLocaleString(); // You might want to get this from the server response
+				var addMessageToChatResult = AddMessageToChat(author, timestamp, message);
+			}
 
 			// Clear the message input
 			messageInput.value = '';
@@ -104,8 +107,8 @@ function AddMessageToChat (author, timestamp, content, full_content, expand_link
 				newMessage.appendChild(hashtagsDiv);
 			}
 
-			// Append the new message to chat-messages
-			chatMessages.appendChild(newMessage);
+			// Newest messages are at the top of chat-messages
+			chatMessages.insertBefore(newMessage, chatMessages.firstChild);
 		} else {
 			console.error("Element with id 'chat-messages' not found");
 		}
@@ -114,6 +117,49 @@ function AddMessageToChat (author, timestamp, content, full_content, expand_link
 	}
 }
 
+function PollForMessages (cursor) { // fallback without EventSource: fetches only messages newer than cursor
+	var xhr = new XMLHttpRequest();
+	xhr.open('GET', '/api/messages?' + (cursor ? 'since=' + encodeURIComponent(cursor) : 'limit=0'), true);
+	xhr.onload = function() {
+		if (xhr.status !== 200) {
+			// server without the message api
+			return;
+		}
+		var result = JSON.parse(xhr.responseText);
+		if (cursor) {
+			for (var i = 0; i < result.messages.length; i++) {
+				var msg = result.messages[i];
+				AddMessageToChat(msg.author, msg.timestamp, msg.content, '', '', msg.hashtags.join(' '));
+			}
+		}
+		setTimeout(function() { PollForMessages(result.cursor); }, 10000);
+	};
+	xhr.send();
+} // PollForMessages()
+
+function ListenForMessages () { // adds new messages as the server pushes them, instead of reloading the page
+	if (!window.EventSource) {
+		PollForMessages('');
+		return false;
+	}
+
+	var source = new EventSource('/api/messages/stream');
+	source.onmessage = function(e) {
+		var msg = JSON.parse(e.data);
+		AddMessageToChat(msg.author, msg.timestamp, msg.content, '', '', msg.hashtags.join(' '));
+	};
+	source.onerror = function() {
+		if (source.readyState === EventSource.CLOSED) {
+			// server without a message stream, e.g. one of the other start_server ports
+			window.messageStream = false;
+		}
+	};
+
+	return source;
+} // ListenForMessages()
+
+window.messageStream = ListenForMessages();
+
 function PingUrl (url, ele) { // loads arbitrary url via image or xhr
 // compatible with most js
 	//alert('DEBUG: PingUrl() begins');
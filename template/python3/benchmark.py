@@ -0,0 +1,169 @@
+# benchmark.py
+# to run: python3 benchmark.py decode|pool|ingest [--count 100000]
+# when editing this file, please retain all the comments and metadata
+
+# benchmark.py
+# Description: Micro-benchmarks for the message ingestion paths, run on a synthetic corpus
+#
+# Each benchmark writes a throwaway corpus of small message files to a
+# temporary directory, times the old code path against the new one and
+# prints both timings with the speedup.
+#
+# Benchmarks:
+# - decode: chardet on every file (plus a second read, as log.html.py did) vs message_decode.read_message
+# - pool: message_index.py cold-build reads run serially and in a spawned Pool, by file count
+# - ingest: commit_files.py metadata extraction reading each file twice vs ingest_file, serially and on a thread pool
+
+import os
+import re
+import sys
+import time
+import hashlib
+import random
+import string
+import shutil
+import argparse
+import tempfile
+import importlib.util
+from multiprocessing import get_context
+from concurrent.futures import ThreadPoolExecutor
+from message_decode import read_message
+import message_index
+
+def random_words(count):
+	return ' '.join(''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(count))
+
+def write_corpus(corpus_dir, count, legacy_ratio=0.01):
+	"""Write count small messages into per-day directories; legacy_ratio of them are latin-1"""
+	file_paths = []
+	for i in range(count):
+		day_dir = os.path.join(corpus_dir, "message", f"2024-01-{i % 28 + 1:02d}")
+		os.makedirs(day_dir, exist_ok=True)
+		file_path = os.path.join(day_dir, f"{i:08d}.txt")
+		content = f"{random_words(random.randint(3, 40))} #tag{i % 50}\n\nAuthor: user{i % 20}"
+		if random.random() < legacy_ratio:
+			data = (content + " café naïve").encode('latin-1')
+		else:
+			data = (content + " ✓").encode('utf-8')
+		with open(file_path, 'wb') as f:
+			f.write(data)
+		file_paths.append(file_path)
+	return file_paths
+
+def time_it(label, func, file_paths):
+	start_time = time.perf_counter()
+	for file_path in file_paths:
+		func(file_path)
+	elapsed = time.perf_counter() - start_time
+	print(f"{label:<40} {elapsed:8.2f} s  {elapsed / len(file_paths) * 1e6:8.1f} us/file")
+	return elapsed
+
+def decode_with_chardet(file_path):
+	import chardet
+	with open(file_path, 'rb') as file:
+		raw_data = file.read()
+	detected_encoding = chardet.detect(raw_data)['encoding']
+	with open(file_path, 'r', encoding=detected_encoding, errors='ignore') as file:
+		return file.read()
+
+def benchmark_decode(file_paths):
+	old = time_it("chardet.detect + re-read", decode_with_chardet, file_paths)
+	new = time_it("read_message (utf-8 fast path)", read_message, file_paths)
+	print(f"speedup: {old / new:.1f}x")
+
+def load_script(file_name):
+	"""Import a script whose file name isn't a valid module name, e.g. chat.html.py"""
+	module_name = file_name[:-len('.py')].replace('.', '_')
+	spec = importlib.util.spec_from_file_location(module_name, os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name))
+	module = importlib.util.module_from_spec(spec)
+	sys.modules[module_name] = module
+	spec.loader.exec_module(module)
+	return module
+
+def benchmark_pool(file_paths):
+	corpus_dir = os.path.dirname(os.path.dirname(os.path.dirname(file_paths[0])))
+	sizes = [n for n in (10, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000) if n <= len(file_paths)]
+	print(f"{'files':>8} {'serial':>10} {'pool':>10}")
+	crossover = None
+	for n in sizes:
+		file_args = [(corpus_dir, os.path.relpath(file_path, corpus_dir), os.stat(file_path), None) for file_path in file_paths[:n]]
+
+		start_time = time.perf_counter()
+		for args in file_args:
+			message_index.read_entry(args)
+		serial = time.perf_counter() - start_time
+
+		# the same spawned, build-scoped pool that message_index.read_entries starts
+		start_time = time.perf_counter()
+		with get_context('spawn').Pool() as pool:
+			pool.map(message_index.read_entry, file_args, message_index.pool_chunksize(n))
+		pooled = time.perf_counter() - start_time
+
+		print(f"{n:>8} {serial * 1000:>8.1f}ms {pooled * 1000:>8.1f}ms")
+		if crossover is None and pooled < serial:
+			crossover = n
+		elif pooled >= serial:
+			crossover = None
+
+	if crossover is None:
+		print(f"crossover: none, serial was fastest at every size ({os.cpu_count()} CPUs)")
+	else:
+		print(f"crossover: the pool wins from {crossover} files ({os.cpu_count()} CPUs); message_index.py SERIAL_THRESHOLD is {message_index.SERIAL_THRESHOLD}")
+
+def is_utf8(file_path):
+	with open(file_path, 'rb') as f:
+		try:
+			f.read().decode('utf-8')
+			return True
+		except UnicodeDecodeError:
+			return False
+
+def metadata_reading_twice(file_path):
+	# commit_files.py before ingest_file: a text read, then a second chunked read for the hash
+	with open(file_path, 'r', encoding='utf-8') as f:
+		content = f.read()
+	sha256_hash = hashlib.sha256()
+	with open(file_path, "rb") as f:
+		for byte_block in iter(lambda: f.read(4096), b""):
+			sha256_hash.update(byte_block)
+	author_match = re.search(r'Author:\s*(.+)', content)
+	title_match = re.search(r'^(.+)', content)
+	return author_match, title_match, re.findall(r'#\w+', content), sha256_hash.hexdigest()
+
+def benchmark_ingest(file_paths):
+	commit_files = load_script('commit_files.py')
+	# the synthetic corpus has a few latin-1 files, which commit_files reports and skips
+	utf8_paths = [file_path for file_path in file_paths if is_utf8(file_path)]
+	old = time_it("read twice, sha256 only", metadata_reading_twice, utf8_paths)
+	serial = time_it("ingest_file (sha256 + blob id)", commit_files.ingest_file, utf8_paths)
+	start_time = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=commit_files.INGEST_WORKERS) as executor:
+		for _ in executor.map(commit_files.ingest_file, utf8_paths):
+			pass
+	threaded = time.perf_counter() - start_time
+	print(f"{'ingest_file, ' + str(commit_files.INGEST_WORKERS) + ' threads':<40} {threaded:8.2f} s  {threaded / len(utf8_paths) * 1e6:8.1f} us/file")
+	print(f"speedup: {old / serial:.1f}x serial, {old / threaded:.1f}x threaded")
+
+BENCHMARKS = {
+	'decode': benchmark_decode,
+	'pool': benchmark_pool,
+	'ingest': benchmark_ingest,
+}
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmark message ingestion on a synthetic corpus.")
+	parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Benchmark to run")
+	parser.add_argument("--count", type=int, default=100000, help="Number of synthetic messages (default: 100000)")
+	parser.add_argument("--seed", type=int, default=1, help="Random seed for the corpus")
+	args = parser.parse_args()
+
+	random.seed(args.seed)
+	corpus_dir = tempfile.mkdtemp(prefix="thimble-bench-")
+	try:
+		print(f"Writing {args.count} messages to {corpus_dir}...", file=sys.stderr)
+		file_paths = write_corpus(corpus_dir, args.count)
+		BENCHMARKS[args.benchmark](file_paths)
+	finally:
+		shutil.rmtree(corpus_dir)
+
+# end of benchmark.py
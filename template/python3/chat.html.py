@@ -4,11 +4,13 @@
 
 import os
 import re
+import hashlib
 from datetime import datetime, timezone
-import chardet
 import argparse
-from multiprocessing import Pool
-from functools import partial
+import heapq
+from message_index import get_message_index
+from message_decode import read_message
+from file_utils import atomic_write, split_template
 
 DEBUG = False
 
@@ -35,14 +37,12 @@ def truncate_message(content, max_length=300):
 		return content, False
 	return content[:max_length] + "...", True
 
-def process_file(file_path, repo_path):
+def process_file(file_path, repo_path, encoding=None):
 	relative_path = os.path.relpath(file_path, repo_path)
 	try:
 		modification_time = datetime.fromtimestamp(os.path.getmtime(file_path), tz=timezone.utc)
-		with open(file_path, 'rb') as file:
-			raw_data = file.read()
-		detected_encoding = chardet.detect(raw_data)['encoding']
-		content = raw_data.decode(detected_encoding)
+		# encoding comes from the message index, so chardet only runs for files it hasn't seen
+		_, content, _ = read_message(file_path, encoding)
 		author, hashtags = extract_metadata(content)
 		content = re.sub(r'author:\s*.+', '', content, flags=re.IGNORECASE).strip()
 		return {
@@ -56,54 +56,128 @@ def process_file(file_path, repo_path):
 		debug_print(f"Error reading file {file_path}: {str(e)}")
 		return None
 
-def generate_chat_html(repo_path, output_file, max_messages=50, max_message_length=300, title="THIMBLE Chat"):
+def render_message(MESSAGE_TEMPLATE, msg, message_id, max_message_length):
+	truncated_content, is_truncated = truncate_message(msg['content'], max_message_length)
+	expand_link = f'<a href="#" class="expand-link" data-message-id="{message_id}">{"Show More" if is_truncated else ""}</a>'
+	full_content = f'<div class="full-message" id="full-message-{message_id}" style="display: none;">{msg["content"]}</div>' if is_truncated else ''
+
+	return MESSAGE_TEMPLATE.format(
+		author=msg['author'],
+		content=truncated_content,
+		full_content=full_content,
+		expand_link=expand_link,
+		timestamp=msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+		hashtags=' '.join(msg['hashtags'])
+	)
+
+# Rendered message fragments for the current top-N window, keyed by fragment_key().
+# When this module runs inside start_server.py the cache survives between runs, so a new message
+# costs one fragment render: it is spliced in at the top and the oldest fragment drops out.
+_fragment_cache = {'template': None, 'fragments': {}}
+
+def fragment_key(entry, max_message_length):
+	# the path is part of the key: copies of a message share a hash and, after a checkout, an mtime
+	return (entry['path'], entry['hash'], entry['mtime'], max_message_length)
+
+def fragment_id(entry):
+	"""DOM id for a message, from its path so it is unique on the page and stable when the window moves"""
+	return hashlib.sha256(entry['path'].encode('utf-8')).hexdigest()[:16]
+
+def write_chat_html(repo_path, out, max_messages=50, max_message_length=300, title="THIMBLE Chat"):
+	"""Write the chat page to a text stream: header, then one message at a time, then footer"""
 	HTML_TEMPLATE = read_file('./template/html/chat_page.html')
 	MESSAGE_TEMPLATE = read_file('./template/html/chat_message.html')
 	CSS_STYLE = read_file('./template/css/chat_style.css')
 	JS_TEMPLATE = read_file('./template/js/chat.js')
 
-	message_dir = os.path.join(repo_path, "message")
-
-	file_paths = []
-	for root, _, files in os.walk(message_dir):
-		for file in files:
-			if file.endswith(".txt"):
-				file_paths.append(os.path.join(root, file))
-
-	with Pool() as pool:
-		messages = pool.map(partial(process_file, repo_path=repo_path), file_paths)
-
-	messages = [msg for msg in messages if msg is not None]
-	messages.sort(key=lambda x: (-x['timestamp'].timestamp(), x['file_path']))
-	messages = messages[:max_messages]
-
-	chat_messages = []
-	for idx, msg in enumerate(messages):
-		truncated_content, is_truncated = truncate_message(msg['content'], max_message_length)
-		expand_link = f'<a href="#" class="expand-link" data-message-id="{idx}">{"Show More" if is_truncated else ""}</a>'
-		full_content = f'<div class="full-message" id="full-message-{idx}" style="display: none;">{msg["content"]}</div>' if is_truncated else ''
-
-		chat_messages.append(MESSAGE_TEMPLATE.format(
-			author=msg['author'],
-			content=truncated_content,
-			full_content=full_content,
-			expand_link=expand_link,
-			timestamp=msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
-			hashtags=' '.join(msg['hashtags'])
-		))
-
-	html_content = HTML_TEMPLATE.format(
-		style=CSS_STYLE,
-		chat_messages=''.join(chat_messages),
-		message_count=len(messages),
-		current_time=datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
-		title=title
-	)
-
-	html_content = html_content.replace('</body>', f'<script>{JS_TEMPLATE}</script></body>')
+	# the index is refreshed by stat-diffing, so only new or changed files are re-read;
+	# a heap picks the newest max_messages entries without sorting the whole archive
+	entries = get_message_index(repo_path)
+	window = heapq.nsmallest(max_messages, entries, key=lambda x: (-x['mtime'], x['path']))
+
+	cached = _fragment_cache['fragments'] if _fragment_cache['template'] == MESSAGE_TEMPLATE else {}
+	fragments = {}
+	missing = []
+	for entry in window:
+		key = fragment_key(entry, max_message_length)
+		if key in cached:
+			fragments[key] = cached[key]
+		else:
+			missing.append((key, entry))
+
+	if missing:
+		file_args = [(os.path.join(repo_path, entry['path']), repo_path, entry['encoding']) for _, entry in missing]
+		messages = [process_file(*args) for args in file_args]
+		for (key, entry), msg in zip(missing, messages):
+			if msg is not None:
+				fragments[key] = render_message(MESSAGE_TEMPLATE, msg, fragment_id(entry), max_message_length)
+
+	debug_print(f"Rendered {len(missing)} of {len(window)} messages, reused {len(window) - len(missing)}")
+	_fragment_cache['template'] = MESSAGE_TEMPLATE
+	_fragment_cache['fragments'] = fragments
+
+	rendered = [fragments[key] for key in (fragment_key(entry, max_message_length) for entry in window) if key in fragments]
+
+	page_fields = {
+		'style': CSS_STYLE,
+		'message_count': len(rendered),
+		'current_time': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+		'title': title
+	}
+	page_head, page_tail = split_template(HTML_TEMPLATE, 'chat_messages')
+
+	out.write(page_head.format(**page_fields))
+
+	for fragment in rendered:
+		out.write(fragment)
+
+	out.write(page_tail.format(**page_fields).replace('</body>', f'<script>{JS_TEMPLATE}</script></body>'))
+
+def message_cursor(entry):
+	return f"{entry['mtime']!r}:{entry['path']}"
+
+def parse_message_cursor(cursor):
+	"""'<mtime>:<relative_path>' -> index sort key"""
+	mtime, _, relative_path = cursor.partition(':')
+	return (float(mtime), relative_path)
+
+def get_messages(repo_path, since=None, limit=50):
+	"""Messages newer than the since cursor, oldest first, plus the cursor to pass next time
+
+	Without a cursor the newest limit messages are returned. Only the selected files are read.
+	"""
+	entries = get_message_index(repo_path)
+	sort_key = lambda entry: (entry['mtime'], entry['path'])
+	if since:
+		since_key = parse_message_cursor(since)
+		selected = heapq.nsmallest(limit, (entry for entry in entries if sort_key(entry) > since_key), key=sort_key)
+	else:
+		selected = heapq.nlargest(limit, entries, key=sort_key)[::-1]
+		if not selected:
+			# limit=0 just asks for the current cursor; on an empty archive that is one before any message,
+			# so the first message posted is returned by the next poll
+			since = message_cursor(max(entries, key=sort_key)) if entries else '0:'
+
+	messages = []
+	for entry in selected:
+		msg = process_file(os.path.join(repo_path, entry['path']), repo_path, entry['encoding'])
+		if msg is not None:
+			messages.append({
+				'author': msg['author'],
+				'content': msg['content'],
+				'timestamp': msg['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+				'hashtags': msg['hashtags'],
+				'path': entry['path'],
+			})
+
+	return {
+		'messages': messages,
+		'cursor': message_cursor(selected[-1]) if selected else since,
+	}
 
-	with open(output_file, 'w', encoding='utf-8') as f:
-		f.write(html_content)
+def generate_chat_html(repo_path, output_file, max_messages=50, max_message_length=300, title="THIMBLE Chat"):
+	with atomic_write(output_file) as f:
+		write_chat_html(repo_path, f, max_messages, max_message_length, title)
 
 if __name__ == "__main__":
 	parser = argparse.ArgumentParser(description="Generate chat HTML from repository messages.")
@@ -10,29 +10,54 @@
 #
 # Main functions:
 # - calculate_file_hash(file_path): Calculates SHA256 hash of a file
-# - extract_metadata(content, file_path): Extracts metadata from file content
+# - extract_metadata(content, file_path, raw_data=None): Extracts metadata from file content
+# - ingest_file(file_path): Reads a file once for its metadata, SHA256 and git blob id
 # - store_metadata(file_path, metadata): Stores metadata as JSON file
+# - load_metadata(file_path): Reads the stored metadata for a file, if any
 # - run_git_command(command): Executes Git commands
-# - commit_text_files(repo_path="."): Main function to process and commit files
+# - stage_files(file_paths): Stages all paths with a single git add
+# - commit_paths(file_paths, message): Commits paths with git plumbing, without staging
+# - commit_text_files(repo_path=".", plumbing=False, paths=None, use_store=False): Main function to process and commit files
 #
-# Usage: python3 commit_files.py
+# Usage: python3 commit_files.py [repo_path] [--plumbing] [--metadata-store] [--files PATH ...]
+# Exits with status 1 if the commit failed; "nothing to commit" is not a failure.
 #
 # The script does the following:
 # 1. Finds all modified and untracked .txt files in the repository
 # 2. Extracts metadata (author, title, hashtags, file hash) from each file
-# 3. Stores metadata in JSON files in a 'metadata' directory
+# 3. Stores metadata in JSON files in a 'metadata' directory, skipping files whose
+#    stored metadata is newer than the file or records the same file hash
+#    (in one metadata.jsonl per directory instead, see metadata_store.py, for directories
+#    that already have one, or for every directory with --metadata-store)
 # 4. Adds all .txt files and metadata files to Git staging
 # 5. Creates a commit with an auto-generated message
 #
+# With --plumbing, steps 4 and 5 bypass git add/commit: blobs are written with
+# one `git hash-object -w --stdin-paths`, only the trees on the path to each
+# changed file are rebuilt with `git ls-tree`/`git mktree`, and the commit is
+# made with `git commit-tree` and `git update-ref`. Changed files are found with
+# a single `git ls-files` scan, or not at all when --files lists them, so the
+# cost of a commit depends on the files committed rather than the repo size.
+#
 # Note: This script should be run from within a Git repository
 
 import os
 import re
 import subprocess
 import sys
+import argparse
 from datetime import datetime
 import json
 import hashlib
+import zlib
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from metadata_store import read_store, write_store, store_path
+
+INGEST_WORKERS = 8
+
+author_regex = re.compile(r'Author:\s*(.+)')
+hashtag_regex = re.compile(r'#\w+')
 
 def calculate_file_hash(file_path):
 	sha256_hash = hashlib.sha256()
@@ -41,34 +66,97 @@ def calculate_file_hash(file_path):
 			sha256_hash.update(byte_block)
 	return sha256_hash.hexdigest()
 
-def extract_metadata(content, file_path):
+def extract_metadata(content, file_path, raw_data=None):
 	metadata = {
 		'author': '',
 		'title': os.path.basename(file_path),
 		'hashtags': [],
-		'file_hash': calculate_file_hash(file_path)
+		# hash the bytes the caller already read instead of opening the file again
+		'file_hash': hashlib.sha256(raw_data).hexdigest() if raw_data is not None else calculate_file_hash(file_path)
 	}
 
 	# Extract author
-	author_match = re.search(r'Author:\s*(.+)', content)
+	author_match = author_regex.search(content)
 	if author_match:
 		metadata['author'] = author_match.group(1)
 
 	# Extract title (assuming it's the first line of the file)
-	title_match = re.search(r'^(.+)', content)
-	if title_match:
-		metadata['title'] = title_match.group(1).strip()
+	first_line = content.partition('\n')[0]
+	if first_line:
+		metadata['title'] = first_line.strip()
 
 	# Extract hashtags
-	metadata['hashtags'] = re.findall(r'#\w+', content)
+	metadata['hashtags'] = hashtag_regex.findall(content)
 
 	return metadata
 
-def store_metadata(file_path, metadata):
-	metadata_dir = os.path.join(os.path.dirname(file_path), 'metadata')
-	os.makedirs(metadata_dir, exist_ok=True)
+def git_blob_id(raw_data):
+	blob_hash = hashlib.sha1(b'blob %d\0' % len(raw_data))
+	blob_hash.update(raw_data)
+	return blob_hash.hexdigest()
+
+def ingest_file(file_path):
+	"""Read a message once; returns (metadata, raw_data, git blob id)"""
+	with open(file_path, 'rb') as f:
+		raw_data = f.read()
+	# strict, like the text-mode read this replaces: undecodable files are reported and skipped
+	content = raw_data.decode('utf-8')
+	return extract_metadata(content, file_path, raw_data), raw_data, git_blob_id(raw_data)
+
+def refresh_metadata(file_path, stored, stored_mtime_ns=None):
+	"""Returns (metadata, changed, blob) given the stored metadata and, if known, when it was written"""
+	if stored is not None and stored_mtime_ns is not None and stored_mtime_ns > os.stat(file_path).st_mtime_ns:
+		# written after the file's last change, so it is still current: skip reading the file
+		return stored, False, None
+	metadata, raw_data, blob_id = ingest_file(file_path)
+	if stored is not None and stored.get('file_hash') == metadata['file_hash']:
+		# touched but not edited, e.g. by a checkout
+		return stored, False, (blob_id, raw_data)
+	return metadata, True, (blob_id, raw_data)
+
+def ingest_and_store(file_path):
+	"""Bring one file's sidecar up to date; returns (metadata, metadata file, rewritten, blob, error)"""
+	try:
+		metadata_file = metadata_file_path(file_path)
+		stored = load_metadata(file_path)
+		metadata, changed, blob = refresh_metadata(file_path, stored, os.stat(metadata_file).st_mtime_ns if stored is not None else None)
+		if changed:
+			store_metadata(file_path, metadata)
+		return metadata, metadata_file, changed, blob, None
+	except Exception as e:
+		return None, None, False, None, e
+
+def ingest_for_store(file_path, stores):
+	"""Like ingest_and_store, but against the directory's metadata.jsonl, which the caller writes once per directory"""
+	try:
+		directory = os.path.dirname(file_path)
+		stored = stores[directory].get(os.path.basename(file_path))
+		# no mtime shortcut: the store is rewritten whenever any message in its directory changes
+		metadata, changed, blob = refresh_metadata(file_path, stored)
+		return metadata, store_path(directory), changed, blob, None
+	except Exception as e:
+		return None, None, False, None, e
+
+def ingest_metadata(file_path, stores):
+	"""ingest_for_store for files in a directory with a store, ingest_and_store for the rest"""
+	if os.path.dirname(file_path) in stores:
+		return ingest_for_store(file_path, stores)
+	return ingest_and_store(file_path)
+
+def metadata_file_path(file_path):
+	return os.path.join(os.path.dirname(file_path), 'metadata', f"{os.path.basename(file_path)}.json")
 
-	metadata_file = os.path.join(metadata_dir, f"{os.path.basename(file_path)}.json")
+def load_metadata(file_path):
+	try:
+		with open(metadata_file_path(file_path), 'r', encoding='utf-8') as f:
+			metadata = json.load(f)
+	except (IOError, ValueError):
+		return None
+	return metadata if isinstance(metadata, dict) and 'file_hash' in metadata else None
+
+def store_metadata(file_path, metadata):
+	metadata_file = metadata_file_path(file_path)
+	os.makedirs(os.path.dirname(metadata_file), exist_ok=True)
 
 	with open(metadata_file, 'w', encoding='utf-8') as f:
 		json.dump(metadata, f, indent=2)
@@ -80,37 +168,225 @@ def run_git_command(command):
 	output, error = process.communicate()
 	return output.decode('utf-8').strip(), error.decode('utf-8').strip()
 
-def commit_text_files(repo_path="."):
+def stage_files(file_paths):
+	# one git process and one index lock for the whole batch; paths go over stdin,
+	# NUL-separated and taken literally, so no shell quoting or glob expansion applies
+	paths = b'\0'.join(file_path.encode('utf-8') for file_path in file_paths)
+	process = subprocess.run(['git', '--literal-pathspecs', 'add', '--pathspec-from-file=-', '--pathspec-file-nul'],
+		input=paths, capture_output=True)
+	return process.stdout.decode('utf-8').strip(), process.stderr.decode('utf-8').strip()
+
+def run_git_plumbing(args, input_data=b'', cwd=None):
+	# no shell, and bytes in and out, so any file name survives the round trip
+	return subprocess.run(['git', *args], input=input_data, cwd=cwd, capture_output=True, check=True).stdout
+
+def read_tree_entries(tree_id):
+	"""{name: (mode, type, object id)} for a single tree level, without recursing"""
+	entries = {}
+	if tree_id is None:
+		return entries
+	for record in run_git_plumbing(['ls-tree', '--full-tree', '-z', tree_id]).split(b'\0'):
+		if record:
+			info, name = record.split(b'\t', 1)
+			mode, object_type, object_id = info.decode('ascii').split(' ')
+			entries[os.fsdecode(name)] = (mode, object_type, object_id)
+	return entries
+
+def write_tree(tree_id, changes):
+	"""Apply changes to tree_id and return the new tree id, or None if it ends up empty
+
+	changes maps a name to a blob entry, to None to delete it, or to a dict of changes for a subdirectory.
+	Only the trees named in changes are read and rewritten.
+	"""
+	entries = read_tree_entries(tree_id)
+	for name, change in changes.items():
+		if isinstance(change, dict):
+			current = entries.get(name)
+			subtree_id = write_tree(current[2] if current and current[1] == 'tree' else None, change)
+			if subtree_id is None:
+				entries.pop(name, None)
+			else:
+				entries[name] = ('040000', 'tree', subtree_id)
+		elif change is None:
+			entries.pop(name, None)
+		else:
+			entries[name] = change
+	if not entries:
+		return None
+	tree_input = b''.join(f"{mode} {object_type} {object_id}\t".encode('ascii') + os.fsencode(name) + b'\0'
+		for name, (mode, object_type, object_id) in entries.items())
+	# mktree sorts the entries itself
+	return run_git_plumbing(['mktree', '-z'], tree_input).decode('ascii').strip()
+
+def file_mode(file_path):
+	return '100755' if os.stat(file_path).st_mode & 0o100 else '100644'
+
+def can_write_blobs(repo_paths, top_level):
+	"""True if these files can be written as loose objects directly
+
+	That needs git to store them byte for byte (no eol conversion or filters), SHA-1 object
+	ids (git_blob_id) and the default object permissions (no core.sharedRepository).
+	"""
+	output = subprocess.run(['git', 'config', '--get-regexp', r'^(core\.autocrlf|core\.sharedrepository|extensions\.objectformat)$'],
+		capture_output=True).stdout.decode('utf-8')
+	# a key set without a value reads as true
+	config = dict((line.split(' ', 1) + [''])[:2] for line in output.splitlines())
+	if config.get('core.autocrlf', 'false') != 'false':
+		return False
+	if config.get('extensions.objectformat', 'sha1') != 'sha1':
+		return False
+	if config.get('core.sharedrepository', 'false') not in ('false', 'umask'):
+		return False
+	output = run_git_plumbing(['check-attr', '-z', '--stdin', 'text', 'eol', 'filter', 'ident', 'working-tree-encoding'],
+		b''.join(os.fsencode(path) + b'\0' for path in repo_paths), cwd=top_level)
+	# records are path, attribute, value
+	values = output.split(b'\0')[2::3]
+	return all(value == b'unspecified' for value in values)
+
+def write_loose_object(objects_dir, object_id, object_type, data):
+	"""Store an object the way git hash-object -w does, unless it is already there"""
+	object_path = os.path.join(objects_dir, object_id[:2], object_id[2:])
+	if os.path.exists(object_path):
+		return
+	os.makedirs(os.path.dirname(object_path), exist_ok=True)
+	tmp_path = f"{object_path}.{os.getpid()}.tmp"
+	with open(tmp_path, 'wb') as f:
+		f.write(zlib.compress(b'%s %d\0' % (object_type, len(data)) + data))
+	# objects are immutable, and git creates them read-only
+	os.chmod(tmp_path, 0o444)
+	os.replace(tmp_path, object_path)
+
+def commit_paths(file_paths, message, known_blobs=None):
+	"""Commit the current contents of file_paths (missing files are deleted) on top of HEAD; returns the commit id
+
+	known_blobs maps a file path to (git blob id, contents) for files the caller has already read.
+	"""
+	top_level = os.fsdecode(run_git_plumbing(['rev-parse', '--show-toplevel']).strip())
+	head = subprocess.run(['git', 'rev-parse', '-q', '--verify', 'HEAD'], capture_output=True).stdout.decode('ascii').strip() or None
+	base_tree = run_git_plumbing(['rev-parse', f'{head}^{{tree}}']).decode('ascii').strip() if head else None
+
+	# git resolves these paths from the top of the work tree, whatever the current directory
+	repo_paths = {os.path.relpath(os.path.abspath(file_path), top_level).replace(os.sep, '/'): file_path for file_path in file_paths}
+	existing = [repo_path for repo_path, file_path in repo_paths.items() if os.path.isfile(file_path)]
+	blobs = {}
+	known = [repo_path for repo_path in existing if repo_paths[repo_path] in (known_blobs or {})]
+	if known and can_write_blobs(known, top_level):
+		# the contents are already in memory, so write them without git reading every file again
+		objects_dir = os.path.join(top_level, os.fsdecode(run_git_plumbing(['rev-parse', '--git-path', 'objects'], cwd=top_level).strip()))
+		for repo_path in known:
+			blob_id, raw_data = known_blobs[repo_paths[repo_path]]
+			write_loose_object(objects_dir, blob_id, b'blob', raw_data)
+			blobs[repo_path] = blob_id
+	unknown = [repo_path for repo_path in existing if repo_path not in blobs]
+	if unknown:
+		# one process writes every blob, applying the same attributes/filters git add would
+		blob_ids = run_git_plumbing(['hash-object', '-w', '--stdin-paths'], b''.join(os.fsencode(path) + b'\n' for path in unknown), cwd=top_level).decode('ascii').split()
+		blobs.update(zip(unknown, blob_ids))
+
+	changes = {}
+	index_info = []
+	for repo_path, file_path in repo_paths.items():
+		*directories, name = repo_path.split('/')
+		node = changes
+		for directory in directories:
+			node = node.setdefault(directory, {})
+		if repo_path in blobs:
+			node[name] = (file_mode(file_path), 'blob', blobs[repo_path])
+			index_info.append((f"{file_mode(file_path)} {blobs[repo_path]}", repo_path))
+		else:
+			node[name] = None
+			index_info.append((None, repo_path))
+
+	tree = write_tree(base_tree, changes) or run_git_plumbing(['mktree']).decode('ascii').strip()
+	if tree == base_tree:
+		return None
+
+	parents = ['-p', head] if head else []
+	commit = run_git_plumbing(['commit-tree', tree, *parents, '-m', message]).decode('ascii').strip()
+	# fails instead of losing a commit if someone else moved HEAD in the meantime;
+	# an empty old value means HEAD must not exist yet
+	run_git_plumbing(['update-ref', '-m', f"commit: {message}", 'HEAD', commit, head or ''])
+	# keep the index in step so git status doesn't report the committed files as changed;
+	# mode 0 and an all-zero id, as long as the repository's ids (SHA-1 or SHA-256), remove an entry
+	null_id = '0' * len(commit)
+	run_git_plumbing(['update-index', '--add', '--remove', '-z', '--index-info'],
+		b''.join(f"{info or '0 ' + null_id}\t".encode('ascii') + os.fsencode(repo_path) + b'\0' for info, repo_path in index_info), cwd=top_level)
+	return commit
+
+def commit_text_files(repo_path=".", plumbing=False, paths=None, use_store=False):
 	curr_dir = os.getcwd()
 	os.chdir(repo_path)
 
-	# Check if there are any changes
-	status_output, _ = run_git_command("git status --porcelain")
-	if not status_output:
-		print("No changes to commit.")
-		return
+	if paths is not None:
+		# the caller already knows what changed, so skip scanning the working tree
+		all_files = paths
+	elif plumbing:
+		# one working-tree scan lists both modified and untracked files
+		listed_files = subprocess.run(['git', 'ls-files', '-z', '--others', '--modified', '--exclude-standard'], capture_output=True).stdout
+		all_files = sorted(set(os.fsdecode(path) for path in listed_files.split(b'\0') if path))
+	else:
+		# Check if there are any changes
+		status_output, _ = run_git_command("git status --porcelain")
+		if not status_output:
+			print("No changes to commit.")
+			return
 
-	# Get all modified and untracked files
-	changed_files, _ = run_git_command("git diff --name-only")
-	untracked_files, _ = run_git_command("git ls-files --others --exclude-standard")
+		# Get all modified and untracked files
+		# paths relative to the working directory (like ls-files), with non-ASCII names unescaped,
+		# since they are passed to git add verbatim
+		changed_files, _ = run_git_command("git -c core.quotepath=off diff --name-only --relative")
+		untracked_files, _ = run_git_command("git -c core.quotepath=off ls-files --others --exclude-standard")
+		# staged by an earlier run whose commit failed
+		staged_files, _ = run_git_command("git -c core.quotepath=off diff --cached --name-only --relative")
 
-	all_files = changed_files.split('\n') + untracked_files.split('\n')
+		all_files = list(dict.fromkeys(changed_files.split('\n') + untracked_files.split('\n') + staged_files.split('\n')))
 	txt_files = [f for f in all_files if f.endswith('.txt')]
 
 	if not txt_files:
 		print("No uncommitted .txt files found.")
 		return
 
-	# Process each file and store metadata
+	# deleted messages are committed as deletions, but there is nothing to read for their metadata
+	present_files = [f for f in txt_files if os.path.isfile(f)]
+
+	# metadata files git already reports as changed; None when the caller named the files instead
+	listed_files = set(all_files) if paths is None else None
+
+	# Process each file and store metadata; each file is read once, on a thread pool
 	metadata_files = []
+	known_blobs = {}
+	unchanged = 0
+	# a directory that already has a metadata.jsonl, e.g. after metadata_store.py migrate,
+	# keeps using it; --metadata-store starts one in every other directory too
+	stores = {directory: read_store(directory) for directory in set(os.path.dirname(f) for f in txt_files)
+		if use_store or os.path.exists(store_path(directory))}
+	ingest = partial(ingest_metadata, stores=stores)
+	# {directory: {name: metadata, or None to drop a deleted message's record}}
+	store_updates = {}
 	for file_path in txt_files:
-		try:
-			with open(file_path, 'r', encoding='utf-8') as f:
-				content = f.read()
-
-			metadata = extract_metadata(content, file_path)
-			metadata_file = store_metadata(file_path, metadata)
+		directory, name = os.path.split(file_path)
+		if not os.path.isfile(file_path) and name in stores.get(directory, {}):
+			store_updates.setdefault(directory, {})[name] = None
+			metadata_files.append(store_path(directory))
+	workers = min(INGEST_WORKERS, os.cpu_count() or 1)
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		# with one CPU, handing files between threads costs more than it overlaps (see benchmark.py ingest)
+		results = executor.map(ingest, present_files) if workers > 1 else map(ingest, present_files)
+		for file_path, (metadata, metadata_file, rewritten, blob, error) in zip(present_files, results):
+			if error is not None:
+				print(f"Error processing file {file_path}: {str(error)}")
+				continue
+			if blob is not None:
+				known_blobs[file_path] = blob
+			if not rewritten:
+				unchanged += 1
+				# an unchanged metadata file only needs staging if it was never committed
+				if listed_files is None or metadata_file in listed_files:
+					metadata_files.append(metadata_file)
+				continue
 			metadata_files.append(metadata_file)
+			if os.path.dirname(file_path) in stores:
+				store_updates.setdefault(os.path.dirname(file_path), {})[os.path.basename(file_path)] = metadata
 
 			print(f"File: {file_path}")
 			print(f"Author: {metadata['author']}")
@@ -118,26 +394,71 @@ def commit_text_files(repo_path="."):
 			print(f"Hashtags: {', '.join(metadata['hashtags'])}")
 			print(f"File Hash: {metadata['file_hash']}")
 			print()
-		except Exception as e:
-			print(f"Error processing file {file_path}: {str(e)}")
 
-	# Add all .txt files and metadata files to staging
-	files_to_add = txt_files + metadata_files
-	for file in files_to_add:
-		run_git_command(f"git add {file}")
+	# one write per directory, however many of its messages changed
+	for directory, updates in store_updates.items():
+		for name, metadata in updates.items():
+			if metadata is None:
+				stores[directory].pop(name, None)
+			else:
+				stores[directory][name] = metadata
+		if stores[directory]:
+			write_store(directory, stores[directory])
+		else:
+			# the last message in the directory is gone; the commit deletes the store with it
+			os.remove(store_path(directory))
+
+	if unchanged:
+		print(f"Metadata already up to date for {unchanged} file(s).")
 
 	# Create commit message
 	commit_message = f"Auto-commit {len(txt_files)} text files and metadata on {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} by commit_files.py"
 
-	# Commit the changes
-	run_git_command(f'git commit -m "{commit_message}"')
+	files_to_add = txt_files + list(dict.fromkeys(metadata_files))
+	if plumbing:
+		try:
+			if commit_paths(files_to_add, commit_message, known_blobs) is None:
+				print("No changes to commit.")
+				os.chdir(curr_dir)
+				return
+		except subprocess.CalledProcessError as e:
+			print(f"Error committing files: {e.stderr.decode('utf-8', errors='replace').strip()}")
+			os.chdir(curr_dir)
+			return False
+	else:
+		# Add all .txt files and metadata files to staging
+		_, error = stage_files(files_to_add)
+		if error:
+			print(f"Error staging files: {error}")
+
+		# e.g. --files named files that were already committed
+		if subprocess.run(['git', 'diff', '--cached', '--quiet']).returncode == 0:
+			print("No changes to commit.")
+			os.chdir(curr_dir)
+			return
+
+		# Commit the changes
+		process = subprocess.run(['git', 'commit', '-m', commit_message], capture_output=True)
+		if process.returncode != 0:
+			print(f"Error committing files: {(process.stderr or process.stdout).decode('utf-8', errors='replace').strip()}")
+			os.chdir(curr_dir)
+			return False
 
 	print(f"Committed {len(txt_files)} text files and their metadata.")
 	print("Commit message:", commit_message)
 	os.chdir(curr_dir)
+	return True
 
 if __name__ == "__main__":
-	repo_path = sys.argv[1] if len(sys.argv) > 1 else "."
-	commit_text_files(repo_path=repo_path)
+	parser = argparse.ArgumentParser(description="Commit text files and their metadata.")
+	parser.add_argument("repo_path", nargs="?", default=".", help="Path to the repository")
+	parser.add_argument("--plumbing", action="store_true", help="Write blobs, trees and the commit directly instead of git add/commit")
+	parser.add_argument("--metadata-store", action="store_true", help="Keep metadata in one metadata.jsonl per directory instead of a sidecar per file (directories that already have one always do)")
+	parser.add_argument("--files", nargs="+", help="Commit these files instead of scanning for changes (paths relative to repo_path)")
+	args = parser.parse_args()
+
+	# a failed commit exits non-zero so callers like start_server.py's commit queue can tell
+	if commit_text_files(repo_path=args.repo_path, plumbing=args.plumbing, paths=args.files, use_store=args.metadata_store) is False:
+		sys.exit(1)
 
 # end of commit_files.py
\ No newline at end of file
@@ -0,0 +1,39 @@
+# file_utils.py
+# shared file helpers for the page generators and caches
+# when editing this file, please retain all the comments and metadata
+
+# file_utils.py
+# Description: Atomic file replacement and streaming template splitting
+#
+# Pages, indexes and caches are rewritten while the server may be
+# reading them, so they are written to a temporary file next to the
+# target and renamed over it: readers see the old file or the new one,
+# never a partial write.
+#
+# Key functions:
+# - atomic_write(file_path, mode='w'): Context manager yielding a file that replaces file_path on success
+# - split_template(template, placeholder): (head, tail) around {placeholder}
+
+import os
+import threading
+from contextlib import contextmanager
+
+@contextmanager
+def atomic_write(file_path, mode='w'):
+	# unique per process and thread, so concurrent writers never share a temporary file
+	tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+	try:
+		with open(tmp_path, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+			yield f
+		os.replace(tmp_path, file_path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+def split_template(template, placeholder):
+	"""Split a page template around {placeholder} so the parts can be written separately"""
+	head, _, tail = template.partition('{' + placeholder + '}')
+	return head, tail
+
+# end of file_utils.py
@@ -0,0 +1,104 @@
+# git_timestamps.py
+# to run: python3 git_timestamps.py [repo_path]
+# when editing this file, please retain all the comments and metadata
+
+# git_timestamps.py
+# Description: Map each file to the time of the last commit that touched it, in one git log pass
+# Output: .thimble/commit_times.json under the repo path, keyed by HEAD
+#
+# Asking git for the last commit of every file separately walks history
+# once per file. Instead, walk `git log --name-only` once, newest first,
+# and keep the first time each path shows up. The map is saved together
+# with the HEAD it was built from; the next run only reads the commits
+# between that HEAD and the new one, and rebuilds from scratch if the old
+# HEAD is no longer an ancestor (e.g. after a history rewrite).
+#
+# Key functions:
+# - get_commit_times(repo_path, pathspec="message"): {relative_path: unix time}
+
+import os
+import sys
+import json
+import subprocess
+import threading
+from file_utils import atomic_write
+
+CACHE_VERSION = 1
+CACHE_DIR = '.thimble'
+CACHE_FILE = 'commit_times.json'
+
+_lock = threading.Lock()
+
+def cache_path(repo_path):
+	return os.path.join(repo_path, CACHE_DIR, CACHE_FILE)
+
+def run_git(repo_path, *args):
+	result = subprocess.run(['git', '-c', 'core.quotepath=off', *args], cwd=repo_path, capture_output=True)
+	return result.returncode, result.stdout
+
+def current_head(repo_path):
+	returncode, output = run_git(repo_path, 'rev-parse', 'HEAD')
+	return output.decode('utf-8').strip() if returncode == 0 else None
+
+def is_ancestor(repo_path, old_head, new_head):
+	returncode, _ = run_git(repo_path, 'merge-base', '--is-ancestor', old_head, new_head)
+	return returncode == 0
+
+def read_commit_times(repo_path, revision, pathspec):
+	"""One newest-first pass over `git log`, keeping the first (latest) time seen for each path"""
+	# --relative keeps paths relative to repo_path even when it is a subdirectory of the work tree
+	_, output = run_git(repo_path, 'log', '-z', '--relative', '--format=%x01%ct', '--name-only', revision, '--', pathspec)
+	times = {}
+	commit_time = None
+	for token in output.decode('utf-8', errors='replace').split('\0'):
+		token = token.strip('\n')
+		if not token:
+			continue
+		if token.startswith('\x01'):
+			commit_time = int(token[1:])
+		elif token not in times:
+			times[token] = commit_time
+	return times
+
+def load_cache(repo_path, pathspec):
+	try:
+		with open(cache_path(repo_path), 'r', encoding='utf-8') as f:
+			cache = json.load(f)
+	except (IOError, ValueError):
+		return None
+	if cache.get('version') != CACHE_VERSION or cache.get('pathspec') != pathspec:
+		return None
+	return cache
+
+def save_cache(repo_path, cache):
+	file_path = cache_path(repo_path)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with atomic_write(file_path) as f:
+		json.dump(cache, f, separators=(',', ':'))
+
+def get_commit_times(repo_path, pathspec="message"):
+	"""Return {path relative to repo_path: last commit unix time} for files under pathspec"""
+	with _lock:
+		head = current_head(repo_path)
+		if head is None:
+			return {}
+
+		cache = load_cache(repo_path, pathspec)
+		if cache and cache['head'] == head:
+			return cache['times']
+
+		if cache and is_ancestor(repo_path, cache['head'], head):
+			times = cache['times']
+			times.update(read_commit_times(repo_path, f"{cache['head']}..{head}", pathspec))
+		else:
+			times = read_commit_times(repo_path, head, pathspec)
+
+		save_cache(repo_path, {'version': CACHE_VERSION, 'pathspec': pathspec, 'head': head, 'times': times})
+		return times
+
+if __name__ == "__main__":
+	repo_path = sys.argv[1] if len(sys.argv) > 1 else "."
+	times = get_commit_times(repo_path)
+	print(f"Commit times for {len(times)} files: {cache_path(repo_path)}")
+
+# end of git_timestamps.py
@@ -3,22 +3,23 @@
 
 # log.html.py
 # Description: Generates an HTML report of message files in a Git repository
-# Dependencies: os, re, datetime, git, gnupg, traceback, chardet
-# Input: None (uses current directory as repo_path)
+# Dependencies: os, datetime, gnupg, traceback, message_index, git_timestamps
+# Input: --repo_path (default: current directory), optional --page N or --before <cursor>
 # Output: log.html file in the current directory
 #
 # This script does the following:
-# 1. Walks through the "message" directory in the repo
-# 2. Reads up to 100 .txt files
-# 3. Extracts metadata (author, hashtags) from each file
-# 4. Retrieves Git commit information for each file
+# 1. Refreshes the message index (message_index.py) for the "message" directory
+# 2. Selects one page (100 files, newest first) from the index with a heap
+# 3. Uses the indexed metadata (author, hashtags) for each file
+# 4. Looks up each file's last commit time from a single git log pass (git_timestamps.py)
 # 5. Generates an HTML report using templates (page.html, page_row.html, webmail.css)
-# 6. Sorts the files by commit timestamp
+# 6. Adds Newest/Newer/Older links; Older uses a before=<timestamp>:<path> cursor
 # 7. Writes the report to log.html
 #
 # Key functions:
 # - read_file(file_path): Reads and returns content of a file
-# - extract_metadata(content): Extracts author and hashtags from file content
+# - select_log_page(file_info, page, per_page, before): Top-K selection of one page
+# - write_log_page(repo_path, out, page, before): Streams the HTML for one page to out
 # - generate_html(repo_path, output_file): Main function to generate the HTML report
 #
 # Note: Requires template files (page.html, page_row.html, webmail.css) in ./template directory
@@ -26,99 +27,115 @@
 # To run: python3 log.html.py
 
 import os
-import re
+import heapq
+import argparse
+import urllib.parse
 from datetime import datetime
-import git
 import gnupg
 import traceback
-import chardet
+from message_index import get_message_index
+from git_timestamps import get_commit_times
+from file_utils import atomic_write, split_template
+
+PAGE_SIZE = 100
 
 def read_file(file_path):
 	with open(file_path, 'r') as file:
 		return file.read()
 
-def extract_metadata(content):
-	author = re.search(r'Author:\s*(.+)', content, re.IGNORECASE)
-	author = author.group(1) if author else ""
-	hashtags = re.findall(r'#\w+', content)
-	return author, hashtags
-
-def generate_html(repo_path, output_file):
-	repo = git.Repo(repo_path)
+def load_file_info(repo_path):
+	commit_times = get_commit_times(repo_path)
+	# entries are only re-read when their mtime or size changed since the last run
+	for entry in get_message_index(repo_path):
+		relative_path = entry['path']
+		yield {
+			'relative_path': relative_path,
+			'commit_time': commit_times.get(relative_path),
+			'mtime': entry['mtime'],
+			'stored_date': os.path.basename(os.path.dirname(relative_path)),
+			'author': entry['author'],
+			'hashtags': entry['hashtags']
+		}
+
+def sort_key(info):
+	commit_time = info['commit_time']
+	# messages not committed yet (e.g. still in the server's commit queue) sort by when they were written
+	return (commit_time if commit_time is not None else info['mtime'], info['relative_path'])
+
+def parse_cursor(before):
+	"""'<timestamp>' or '<timestamp>:<relative_path>' -> sort key; rows strictly older than it are returned"""
+	timestamp, _, relative_path = before.partition(':')
+	return (float(timestamp), relative_path)
+
+def format_cursor(info):
+	return f"{sort_key(info)[0]}:{info['relative_path']}"
+
+def select_log_page(file_info, page=0, per_page=PAGE_SIZE, before=None):
+	"""Newest-first page of file_info; a heap keeps only the rows needed instead of sorting everything"""
+	if before is not None:
+		cursor = parse_cursor(before)
+		return heapq.nlargest(per_page, (info for info in file_info if sort_key(info) < cursor), key=sort_key)
+	return heapq.nlargest((page + 1) * per_page, file_info, key=sort_key)[page * per_page:]
+
+def pagination_links(rows, page, per_page, before):
+	links = []
+	if page > 0 or before is not None:
+		links.append('<a href="/log.html">Newest</a>')
+	if page > 0 and before is None:
+		links.append(f'<a href="/log.html?page={page - 1}">Newer</a>')
+	if len(rows) == per_page:
+		cursor = urllib.parse.quote(format_cursor(rows[-1]), safe='')
+		links.append(f'<a href="/log.html?before={cursor}">Older</a>')
+	return f'<div class="pagination">{" | ".join(links)}</div>' if links else ''
+
+def write_log_page(repo_path, out, page=0, before=None, per_page=PAGE_SIZE):
+	"""Write one page of the report to a text stream: header, then one row at a time, then footer"""
 	HTML_TEMPLATE = read_file('./template/html/page.html')
 	TABLE_ROW_TEMPLATE = read_file('./template/html/page_row.html')
 	CSS_STYLE = read_file('./template/css/webmail.css')
 
-	file_info = []
-	file_count = 0
-	for root, dirs, files in os.walk(os.path.join(repo_path, "message")):
-		for file in files:
-			if file.endswith(".txt"):
-				file_path = os.path.join(root, file)
-				relative_path = os.path.relpath(file_path, repo_path)
-
-				try:
-					commit = next(repo.iter_commits(paths=relative_path, max_count=1))
-					commit_timestamp = datetime.fromtimestamp(commit.committed_date)
-				except StopIteration:
-					commit_timestamp = datetime.min
-
-				stored_date = os.path.basename(os.path.dirname(file_path))
-				try:
-					with open(file_path, 'rb') as file:
-						raw_data = file.read()
-					detected_encoding = chardet.detect(raw_data)['encoding']
-					with open(file_path, 'r', encoding=detected_encoding, errors='ignore') as file:
-						content = file.read()
-					author, hashtags = extract_metadata(content)
-				except Exception as e:
-					print(f"Error reading file {file_path}: {str(e)}")
-					author = "Error"
-					hashtags = []
-
-				file_info.append({
-					'relative_path': relative_path,
-					'commit_timestamp': commit_timestamp,
-					'stored_date': stored_date,
-					'author': author,
-					'hashtags': hashtags
-				})
-
-				file_count += 1
-				if file_count >= 100:
-					break
-
-		if file_count >= 100:
-			break
-
-	# Sort the file_info list by commit_timestamp in descending order
-	file_info.sort(key=lambda x: x['commit_timestamp'], reverse=True)
-
-	table_rows = []
-	for info in file_info:
-		table_rows.append(TABLE_ROW_TEMPLATE.format(
+	rows = select_log_page(load_file_info(repo_path), page, per_page, before)
+
+	page_fields = {
+		'style': CSS_STYLE,
+		'file_count': len(rows),
+		'current_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+		'title': "THIMBLE"
+	}
+	page_head, page_tail = split_template(HTML_TEMPLATE, 'table_rows')
+
+	out.write(page_head.format(**page_fields))
+
+	for info in rows:
+		if info['commit_time'] is not None:
+			commit_timestamp = datetime.fromtimestamp(info['commit_time'])
+		else:
+			commit_timestamp = datetime.min
+		out.write(TABLE_ROW_TEMPLATE.format(
 			relative_path=info['relative_path'],
-			commit_timestamp=info['commit_timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+			commit_timestamp=commit_timestamp.strftime('%Y-%m-%d %H:%M:%S'),
 			stored_date=info['stored_date'],
 			author=info['author'],
 			hashtags=', '.join(info['hashtags'])
 		))
 
-	html_content = HTML_TEMPLATE.format(
-		style=CSS_STYLE,
-		table_rows=''.join(table_rows),
-		file_count=file_count,
-		current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-		title="THIMBLE"
-	)
+	# page.html is shared with the other log.html ports, so the links are added here rather than as a placeholder
+	page_tail = page_tail.format(**page_fields)
+	out.write(page_tail.replace('</table>', '</table>' + pagination_links(rows, page, per_page, before), 1))
 
-	with open(output_file, 'w', encoding='utf-8') as f:
-		f.write(html_content)
+def generate_html(repo_path, output_file, page=0, before=None):
+	with atomic_write(output_file) as f:
+		write_log_page(repo_path, f, page, before)
 
 if __name__ == "__main__":
-	repo_path = "."  # Current directory
-	output_file = 'log.html'
-	generate_html(repo_path, output_file)
-	print(f"Report generated: {output_file}")
+	parser = argparse.ArgumentParser(description="Generate an HTML report of message files.")
+	parser.add_argument("--repo_path", default=".", help="Path to the repository")
+	parser.add_argument("--output_file", default="log.html", help="Output HTML file name")
+	parser.add_argument("--page", type=int, default=0, help="Page number, 0 is the newest")
+	parser.add_argument("--before", help="Only list files older than this cursor (<timestamp> or <timestamp>:<path>)")
+	args = parser.parse_args()
+
+	generate_html(args.repo_path, args.output_file, args.page, args.before)
+	print(f"Report generated: {args.output_file}")
 
 # end of log.html.py
\ No newline at end of file
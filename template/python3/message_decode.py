@@ -0,0 +1,54 @@
+# message_decode.py
+# shared decoding for message files
+# when editing this file, please retain all the comments and metadata
+
+# message_decode.py
+# Description: Decode message bytes, trying strict UTF-8 before falling back to chardet
+#
+# Almost every message is small UTF-8 text, so a strict UTF-8 decode
+# succeeds and chardet (slow to import and slow to run) is only needed
+# for the odd legacy file. Callers that already know a file's encoding
+# (e.g. from the message index) can pass it in; it is tried after
+# UTF-8, since single-byte codecs decode almost anything and would
+# otherwise stick to a file that has since been rewritten as UTF-8.
+#
+# Key functions:
+# - detect_encoding(raw_data): Encoding name for the given bytes
+# - decode_message(raw_data, encoding=None): (content, encoding)
+# - read_message(file_path, encoding=None): (raw_data, content, encoding), reading the file once
+
+def detect_legacy_encoding(raw_data):
+	# imported lazily, most runs never need it
+	import chardet
+	return chardet.detect(raw_data)['encoding'] or 'utf-8'
+
+def detect_encoding(raw_data):
+	try:
+		raw_data.decode('utf-8')
+		return 'utf-8'
+	except UnicodeDecodeError:
+		return detect_legacy_encoding(raw_data)
+
+def decode_message(raw_data, encoding=None):
+	try:
+		return raw_data.decode('utf-8'), 'utf-8'
+	except UnicodeDecodeError:
+		pass
+	if encoding and encoding != 'utf-8':
+		try:
+			return raw_data.decode(encoding), encoding
+		except (UnicodeDecodeError, LookupError):
+			pass
+	encoding = detect_legacy_encoding(raw_data)
+	try:
+		return raw_data.decode(encoding, errors='replace'), encoding
+	except LookupError:
+		return raw_data.decode('utf-8', errors='replace'), 'utf-8'
+
+def read_message(file_path, encoding=None):
+	with open(file_path, 'rb') as file:
+		raw_data = file.read()
+	content, encoding = decode_message(raw_data, encoding)
+	return raw_data, content, encoding
+
+# end of message_decode.py
@@ -0,0 +1,222 @@
+# message_index.py
+# to run: python3 message_index.py [repo_path]
+# when editing this file, please retain all the comments and metadata
+
+# message_index.py
+# Description: Persistent, incrementally updated index of the message/ tree
+# Output: .thimble/message_index.json under the repo path
+#
+# Each .txt file under message/ gets one entry:
+#   path, mtime, size, hash (sha256), encoding, author, hashtags, title
+#
+# refresh_index() stats every file and only re-reads the ones whose
+# mtime or size changed since the last run, so page generators like
+# chat.html.py and log.html.py do work proportional to what changed
+# instead of re-reading the whole archive. Where a directory has a
+# metadata.jsonl store (metadata_store.py) written after a message last
+# changed, the entry comes from the store and the message isn't read.
+#
+# A cold build (a fresh clone, or a deleted .thimble/) reads every file
+# once; past SERIAL_THRESHOLD files it does so in a process pool that
+# lives only for that build.
+#
+# Key functions:
+# - get_message_index(repo_path): Refreshed list of index entries
+# - refresh_index(repo_path): Stat-diff the message tree against the stored index
+
+import os
+import re
+import sys
+import json
+import hashlib
+import threading
+from multiprocessing import get_context
+from message_decode import read_message
+from file_utils import atomic_write
+from metadata_store import read_store, store_path
+
+INDEX_VERSION = 2
+INDEX_DIR = '.thimble'
+INDEX_FILE = 'message_index.json'
+
+author_regex = re.compile(r'Author:\s*(.+)', re.IGNORECASE)
+hashtag_regex = re.compile(r'#\w+')
+title_regex = re.compile(r'^(.+)')
+
+# Below this many files to read, starting a process pool costs more than it saves.
+# Re-measure with `python3 benchmark.py pool`, which prints the crossover for the current machine.
+SERIAL_THRESHOLD = 1000
+
+# indexes already loaded by this process, keyed by absolute repo path
+_indexes = {}
+_lock = threading.Lock()
+
+def index_path(repo_path):
+	return os.path.join(repo_path, INDEX_DIR, INDEX_FILE)
+
+def empty_index():
+	return {'version': INDEX_VERSION, 'files': {}}
+
+def load_index(repo_path):
+	try:
+		with open(index_path(repo_path), 'r', encoding='utf-8') as f:
+			index = json.load(f)
+	except (IOError, ValueError):
+		return empty_index()
+	if index.get('version') != INDEX_VERSION:
+		return empty_index()
+	return index
+
+def save_index(repo_path, index):
+	file_path = index_path(repo_path)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with atomic_write(file_path) as f:
+		json.dump(index, f, separators=(',', ':'))
+
+def scan_message_files(repo_path):
+	"""Return {relative_path: stat_result} for every .txt file under message/"""
+	found = {}
+	stack = [os.path.join(repo_path, "message")]
+	while stack:
+		try:
+			entries = os.scandir(stack.pop())
+		except OSError:
+			continue
+		with entries:
+			for entry in entries:
+				if entry.is_dir(follow_symlinks=False):
+					stack.append(entry.path)
+				elif entry.name.endswith(".txt"):
+					found[os.path.relpath(entry.path, repo_path)] = entry.stat()
+	return found
+
+def extract_fields(content):
+	author = author_regex.search(content)
+	title = title_regex.search(content)
+	return {
+		'author': author.group(1).strip() if author else "",
+		'hashtags': hashtag_regex.findall(content),
+		'title': title.group(1).strip() if title else "",
+	}
+
+def index_file(repo_path, relative_path, stat, encoding=None):
+	raw_data, content, encoding = read_message(os.path.join(repo_path, relative_path), encoding)
+	entry = {
+		'path': relative_path,
+		'mtime': stat.st_mtime,
+		'size': stat.st_size,
+		'hash': hashlib.sha256(raw_data).hexdigest(),
+		'encoding': encoding,
+	}
+	entry.update(extract_fields(content))
+	if not entry['title']:
+		entry['title'] = os.path.basename(relative_path)
+	return entry
+
+def read_entry(args):
+	"""index_file for one (repo_path, relative_path, stat, encoding); returns (entry, error)"""
+	try:
+		return index_file(*args), None
+	except (IOError, OSError) as e:
+		return None, str(e)
+
+def pool_chunksize(file_count):
+	# a few chunks per worker keeps them busy without paying per-file IPC
+	return max(1, file_count // ((os.cpu_count() or 1) * 4))
+
+def read_entries(file_args):
+	"""read_entry over file_args, in a process pool when there are enough files to pay for one"""
+	if len(file_args) < SERIAL_THRESHOLD or (os.cpu_count() or 1) < 2:
+		return [read_entry(args) for args in file_args]
+	# spawned rather than forked: start_server.py refreshes the index from its request threads
+	with get_context('spawn').Pool() as pool:
+		return pool.map(read_entry, file_args, pool_chunksize(len(file_args)))
+
+def stored_entry(repo_path, relative_path, stat, stores):
+	"""Index entry from the directory's metadata.jsonl, if it was written after the file last changed"""
+	directory = os.path.dirname(relative_path)
+	if directory not in stores:
+		# one sequential read per directory, shared by every message in it
+		try:
+			store_mtime_ns = os.stat(store_path(os.path.join(repo_path, directory))).st_mtime_ns
+		except OSError:
+			store_mtime_ns = None
+		stores[directory] = (read_store(os.path.join(repo_path, directory)) if store_mtime_ns else {}, store_mtime_ns)
+	records, store_mtime_ns = stores[directory]
+	record = records.get(os.path.basename(relative_path))
+	if record is None or 'file_hash' not in record or store_mtime_ns <= stat.st_mtime_ns:
+		return None
+	if not record.get('author'):
+		# commit_files.py only matches 'Author:' case-sensitively, so read the file to check for 'author:'
+		return None
+	return {
+		'path': relative_path,
+		'mtime': stat.st_mtime,
+		'size': stat.st_size,
+		'hash': record['file_hash'],
+		# unknown until the file is read; readers try UTF-8 first
+		'encoding': None,
+		'author': record['author'].strip(),
+		# some ports record hashtags without the leading '#'
+		'hashtags': ['#' + tag.lstrip('#') for tag in record.get('hashtags', [])],
+		'title': record.get('title') or os.path.basename(relative_path),
+	}
+
+def is_current(entry, stat):
+	return entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+
+def cached_index(repo_path):
+	key = os.path.abspath(repo_path)
+	if key not in _indexes:
+		_indexes[key] = load_index(repo_path)
+	return _indexes[key]
+
+def refresh_index(repo_path):
+	"""Bring the index in line with the message tree; returns (index, number of changed entries)"""
+	with _lock:
+		index = cached_index(repo_path)
+		files = index['files']
+		on_disk = scan_message_files(repo_path)
+		changed = 0
+		stores = {}
+		file_args = []
+
+		for relative_path in [path for path in files if path not in on_disk]:
+			del files[relative_path]
+			changed += 1
+
+		for relative_path, stat in on_disk.items():
+			entry = files.get(relative_path)
+			if is_current(entry, stat):
+				continue
+			from_store = stored_entry(repo_path, relative_path, stat, stores)
+			if from_store is not None:
+				files[relative_path] = from_store
+				changed += 1
+				continue
+			# a changed file usually keeps its encoding, so try the cached one first
+			file_args.append((repo_path, relative_path, stat, entry and entry['encoding']))
+
+		for (_, relative_path, _, _), (entry, error) in zip(file_args, read_entries(file_args)):
+			if entry is None:
+				print(f"Error indexing file {relative_path}: {error}", file=sys.stderr)
+				files.pop(relative_path, None)
+			else:
+				files[relative_path] = entry
+			changed += 1
+
+		if changed:
+			save_index(repo_path, index)
+		return index, changed
+
+def get_message_index(repo_path):
+	"""Refreshed list of index entries for every message file"""
+	index, _ = refresh_index(repo_path)
+	return list(index['files'].values())
+
+if __name__ == "__main__":
+	repo_path = sys.argv[1] if len(sys.argv) > 1 else "."
+	index, changed = refresh_index(repo_path)
+	print(f"Indexed {len(index['files'])} message files ({changed} changed): {index_path(repo_path)}")
+
+# end of message_index.py
@@ -0,0 +1,134 @@
+# metadata_store.py
+# to run: python3 metadata_store.py migrate|export [repo_path] [--remove-sidecars]
+# when editing this file, please retain all the comments and metadata
+
+# metadata_store.py
+# Description: Per-directory JSON Lines store for message metadata
+# Output: metadata.jsonl next to the messages it describes, e.g. message/2024-07-18/metadata.jsonl
+#
+# commit_files.py has always written one pretty-printed sidecar per
+# message (<dir>/metadata/<name>.txt.json), which doubles the file count
+# and makes every reader open thousands of tiny files. The store keeps
+# the same fields, one compact line per message sorted by name:
+#
+#   {"name": "hello.txt", "author": "...", "title": "...", "hashtags": [...], "file_hash": "..."}
+#
+# so a reader loads a whole day with one sequential read, and a commit
+# that adds a message changes one line of one file.
+#
+# Key functions:
+# - read_store(directory): {name: metadata} for the messages in one directory
+# - update_store(directory, updates): Merge {name: metadata} into the store
+# - migrate(repo_path, remove_sidecars=False): Fold existing sidecars into stores
+# - export(repo_path): Write sidecars back out from the stores
+
+import os
+import sys
+import json
+import argparse
+from file_utils import atomic_write
+
+STORE_FILE = 'metadata.jsonl'
+SIDECAR_DIR = 'metadata'
+SIDECAR_SUFFIX = '.json'
+
+def store_path(directory):
+	return os.path.join(directory, STORE_FILE)
+
+def read_store(directory):
+	"""{name: metadata} for one directory; missing stores and unreadable lines are skipped"""
+	records = {}
+	try:
+		with open(store_path(directory), 'r', encoding='utf-8') as f:
+			for line in f:
+				try:
+					record = json.loads(line)
+					records[record.pop('name')] = record
+				except (ValueError, KeyError, AttributeError):
+					continue
+	except IOError:
+		pass
+	return records
+
+def write_store(directory, records):
+	file_path = store_path(directory)
+	with atomic_write(file_path) as f:
+		for name in sorted(records):
+			f.write(json.dumps(dict(name=name, **records[name]), ensure_ascii=False, separators=(',', ':')) + '\n')
+	return file_path
+
+def update_store(directory, updates):
+	records = read_store(directory)
+	records.update(updates)
+	return write_store(directory, records)
+
+def message_directories(repo_path):
+	"""Every directory under message/ except the sidecar directories themselves"""
+	for directory, subdirectories, _ in os.walk(os.path.join(repo_path, "message")):
+		subdirectories[:] = [name for name in subdirectories if name != SIDECAR_DIR]
+		yield directory
+
+def read_sidecars(directory):
+	"""{name: metadata} from the <directory>/metadata/<name>.json sidecars"""
+	sidecar_dir = os.path.join(directory, SIDECAR_DIR)
+	sidecars = {}
+	try:
+		entries = os.scandir(sidecar_dir)
+	except OSError:
+		return sidecars
+	with entries:
+		for entry in entries:
+			if not entry.name.endswith('.txt' + SIDECAR_SUFFIX):
+				continue
+			try:
+				with open(entry.path, 'r', encoding='utf-8') as f:
+					sidecars[entry.name[:-len(SIDECAR_SUFFIX)]] = json.load(f)
+			except (IOError, ValueError) as e:
+				print(f"Error reading sidecar {entry.path}: {str(e)}", file=sys.stderr)
+	return sidecars
+
+def migrate(repo_path, remove_sidecars=False):
+	"""Fold sidecars into each directory's store; returns the number of messages migrated"""
+	migrated = 0
+	for directory in message_directories(repo_path):
+		sidecars = read_sidecars(directory)
+		if not sidecars:
+			continue
+		update_store(directory, sidecars)
+		migrated += len(sidecars)
+		if remove_sidecars:
+			sidecar_dir = os.path.join(directory, SIDECAR_DIR)
+			for name in sidecars:
+				os.remove(os.path.join(sidecar_dir, name + SIDECAR_SUFFIX))
+			if not os.listdir(sidecar_dir):
+				os.rmdir(sidecar_dir)
+	return migrated
+
+def export(repo_path):
+	"""Write a sidecar for every message in the stores, in commit_files.py's format; returns the count"""
+	exported = 0
+	for directory in message_directories(repo_path):
+		records = read_store(directory)
+		if not records:
+			continue
+		sidecar_dir = os.path.join(directory, SIDECAR_DIR)
+		os.makedirs(sidecar_dir, exist_ok=True)
+		for name, metadata in records.items():
+			with open(os.path.join(sidecar_dir, name + SIDECAR_SUFFIX), 'w', encoding='utf-8') as f:
+				json.dump(metadata, f, indent=2)
+			exported += 1
+	return exported
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Convert message metadata between sidecars and metadata.jsonl stores.")
+	parser.add_argument("command", choices=["migrate", "export"], help="migrate: sidecars to stores, export: stores to sidecars")
+	parser.add_argument("repo_path", nargs="?", default=".", help="Path to the repository")
+	parser.add_argument("--remove-sidecars", action="store_true", help="Delete sidecars once migrated")
+	args = parser.parse_args()
+
+	if args.command == "migrate":
+		print(f"Migrated {migrate(args.repo_path, args.remove_sidecars)} sidecars to {STORE_FILE} stores")
+	else:
+		print(f"Exported {export(args.repo_path)} sidecars from {STORE_FILE} stores")
+
+# end of metadata_store.py
@@ -0,0 +1,238 @@
+# search_index.py
+# to run: python3 search_index.py [--repo_path .] [--q words] [--tag hashtag] [--author name]
+# when editing this file, please retain all the comments and metadata
+
+# search_index.py
+# Description: Full-text, hashtag and author search over the message archive
+# Output: .thimble/search.db (SQLite) under the repo path
+#
+# Message text goes into an FTS5 table, hashtags into a (tag, id) table
+# and authors into an indexed column, so a query is a few B-tree and
+# posting-list lookups instead of a scan of every file.
+#
+# The database is kept in step with message_index.py: sync_index()
+# compares content hashes and only reads and re-indexes files that are
+# new or changed, and drops rows for deleted files. Each process keeps
+# the (hash, mtime) it last synced for every path, so after the first
+# sync only the changed paths are looked up in the database.
+#
+# Syncs write through one connection per repo and hold a lock only for
+# their transaction; searches run on a read connection per thread,
+# which WAL mode lets proceed while a sync is writing.
+#
+# Key functions:
+# - sync_index(repo_path): Bring search.db up to date; returns the number of changed messages
+# - search(repo_path, q=None, tags=(), author=None, limit=50, refresh=True): Newest matches first
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timezone
+from message_index import get_message_index
+from message_decode import read_message
+
+SEARCH_VERSION = 1
+INDEX_DIR = '.thimble'
+INDEX_FILE = 'search.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+	id INTEGER PRIMARY KEY,
+	path TEXT UNIQUE NOT NULL,
+	hash TEXT NOT NULL,
+	mtime REAL NOT NULL,
+	author TEXT NOT NULL,
+	title TEXT NOT NULL,
+	hashtags TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_mtime ON messages (mtime);
+CREATE INDEX IF NOT EXISTS messages_author ON messages (author COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS tags (
+	tag TEXT NOT NULL,
+	id INTEGER NOT NULL,
+	PRIMARY KEY (tag, id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (content, tokenize = 'unicode61');
+"""
+
+# one writing connection per repo, shared by the server's threads and guarded by _lock
+_connections = {}
+_lock = threading.Lock()
+# per thread {repo: read connection}
+_readers = threading.local()
+# {repo: {path: (hash, mtime)}} as of this process's last sync, guarded by _lock
+_synced = {}
+
+def database_path(repo_path):
+	return os.path.join(repo_path, INDEX_DIR, INDEX_FILE)
+
+def connect(repo_path):
+	key = os.path.abspath(repo_path)
+	if key in _connections:
+		return _connections[key]
+	file_path = database_path(repo_path)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	connection = sqlite3.connect(file_path, check_same_thread=False)
+	connection.execute("PRAGMA journal_mode = WAL")
+	if connection.execute("PRAGMA user_version").fetchone()[0] != SEARCH_VERSION:
+		# schema changed: start over, sync_index() rebuilds everything
+		connection.executescript("DROP TABLE IF EXISTS messages; DROP TABLE IF EXISTS tags; DROP TABLE IF EXISTS messages_fts;")
+		connection.executescript(SCHEMA)
+		connection.execute(f"PRAGMA user_version = {SEARCH_VERSION}")
+		connection.commit()
+	_connections[key] = connection
+	return connection
+
+def read_connection(repo_path):
+	key = os.path.abspath(repo_path)
+	connections = getattr(_readers, 'connections', None)
+	if connections is None:
+		connections = _readers.connections = {}
+	if key not in connections:
+		if key not in _connections:
+			with _lock:
+				# creates the database and its schema on first use
+				connect(repo_path)
+		connections[key] = sqlite3.connect(database_path(repo_path))
+	return connections[key]
+
+def normalize_tag(tag):
+	return '#' + tag.lstrip('#').lower()
+
+def delete_message(connection, message_id):
+	connection.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+	connection.execute("DELETE FROM tags WHERE id = ?", (message_id,))
+	connection.execute("DELETE FROM messages_fts WHERE rowid = ?", (message_id,))
+
+def insert_message(connection, entry, content):
+	cursor = connection.execute(
+		"INSERT INTO messages (path, hash, mtime, author, title, hashtags) VALUES (?, ?, ?, ?, ?, ?)",
+		(entry['path'], entry['hash'], entry['mtime'], entry['author'], entry['title'], json.dumps(entry['hashtags'])))
+	message_id = cursor.lastrowid
+	connection.executemany("INSERT OR IGNORE INTO tags (tag, id) VALUES (?, ?)",
+		[(normalize_tag(tag), message_id) for tag in entry['hashtags']])
+	connection.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (message_id, content))
+
+def read_content(repo_path, entry):
+	try:
+		_, content, _ = read_message(os.path.join(repo_path, entry['path']), entry['encoding'])
+		return content
+	except (IOError, OSError) as e:
+		print(f"Error indexing file {entry['path']}: {str(e)}", file=sys.stderr)
+		return None
+
+def sync_index(repo_path):
+	"""Re-index new and changed messages and drop deleted ones; returns the number of changes"""
+	key = os.path.abspath(repo_path)
+	entries = {entry['path']: entry for entry in get_message_index(repo_path)}
+	with _lock:
+		if key not in _synced:
+			# the first sync in this process reads every row once; later ones only touch changed paths
+			_synced[key] = {path: (file_hash, mtime) for path, file_hash, mtime
+				in connect(repo_path).execute("SELECT path, hash, mtime FROM messages")}
+		synced = dict(_synced[key])
+
+	# files are read before taking the lock, so searches and other syncs don't wait on the disk
+	updates = []
+	for path, entry in entries.items():
+		current = synced.get(path)
+		if current == (entry['hash'], entry['mtime']):
+			continue
+		# touched but not edited: only the sort order changes, nothing to read
+		content = None if current is not None and current[0] == entry['hash'] else read_content(repo_path, entry)
+		if content is not None or current is not None:
+			updates.append((entry, content))
+	deleted = [path for path in synced if path not in entries]
+
+	with _lock:
+		connection = connect(repo_path)
+		synced = _synced[key]
+		changed = 0
+		with connection:
+			for entry, content in updates:
+				row = connection.execute("SELECT id, hash FROM messages WHERE path = ?", (entry['path'],)).fetchone()
+				if row is not None and row[1] == entry['hash']:
+					connection.execute("UPDATE messages SET mtime = ? WHERE id = ?", (entry['mtime'], row[0]))
+				else:
+					if content is None:
+						# another process changed the row since this one last synced
+						content = read_content(repo_path, entry)
+						if content is None:
+							continue
+					if row is not None:
+						delete_message(connection, row[0])
+					insert_message(connection, entry, content)
+					changed += 1
+				synced[entry['path']] = (entry['hash'], entry['mtime'])
+			for path in deleted:
+				row = connection.execute("SELECT id FROM messages WHERE path = ?", (path,)).fetchone()
+				if row is not None:
+					delete_message(connection, row[0])
+					changed += 1
+				synced.pop(path, None)
+		return changed
+
+def match_expression(q):
+	"""Turn free text into an FTS5 query: every word must match, a trailing * matches a prefix"""
+	terms = []
+	for word in q.split():
+		prefix = word.endswith('*')
+		word = word.rstrip('*').replace('"', '""')
+		if word:
+			terms.append(f'"{word}"*' if prefix else f'"{word}"')
+	return ' '.join(terms)
+
+def search(repo_path, q=None, tags=(), author=None, limit=50, refresh=True):
+	"""Messages matching all of the given words, hashtags and author, newest first"""
+	if refresh:
+		sync_index(repo_path)
+
+	conditions = []
+	params = []
+	if q and match_expression(q):
+		conditions.append("id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+		params.append(match_expression(q))
+	for tag in tags:
+		conditions.append("id IN (SELECT id FROM tags WHERE tag = ?)")
+		params.append(normalize_tag(tag))
+	if author:
+		conditions.append("author = ? COLLATE NOCASE")
+		params.append(author.strip())
+	if not conditions:
+		# e.g. q='*' or only punctuation: no words to match, and never the whole archive unfiltered
+		return []
+
+	sql = "SELECT path, mtime, author, title, hashtags FROM messages"
+	if conditions:
+		sql += " WHERE " + " AND ".join(conditions)
+	sql += " ORDER BY mtime DESC, path LIMIT ?"
+	params.append(limit)
+
+	rows = read_connection(repo_path).execute(sql, params).fetchall()
+
+	return [{
+		'path': path,
+		'timestamp': datetime.fromtimestamp(mtime, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+		'author': author,
+		'title': title,
+		'hashtags': json.loads(hashtags),
+	} for path, mtime, author, title, hashtags in rows]
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Search repository messages.")
+	parser.add_argument("--repo_path", default=".", help="Path to the repository")
+	parser.add_argument("--q", help="Words that must all appear in the message")
+	parser.add_argument("--tag", action="append", default=[], help="Hashtag the message must carry (repeatable)")
+	parser.add_argument("--author", help="Author of the message")
+	parser.add_argument("--limit", type=int, default=50, help="Maximum number of results")
+	args = parser.parse_args()
+
+	changed = sync_index(args.repo_path)
+	print(f"Search index: {database_path(args.repo_path)} ({changed} messages updated)", file=sys.stderr)
+	for result in search(args.repo_path, args.q, args.tag, args.author, args.limit, refresh=False):
+		print(f"{result['timestamp']}  {result['path']}  {result['author']}  {' '.join(result['hashtags'])}")
+
+# end of search_index.py
@@ -6,18 +6,37 @@
 # start_server: v4
 
 import argparse
+import asyncio
+import ctypes
+import ctypes.util
+import difflib
+import email.utils
+import gzip
 import html
 import http.server
+import importlib.util
+import json
 import os
+import queue
 import random
+import re
+import select
+import shutil
 import socket
 import socketserver
 import string
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 import urllib.parse
-from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import List, Tuple
+from file_utils import atomic_write
 
 # Configuration constants
 SCRIPT_TYPES = ['py', 'pl', 'rb', 'sh', 'js']
@@ -33,6 +52,48 @@ MIME_TYPES = {
     'jpg': 'image/jpeg',
     'gif': 'image/gif',
 }
+# Python page generators that are imported once and called in-process
+IN_PROCESS_RENDERERS = {
+    'chat.html': ('chat.html.py', 'generate_chat_html'),
+    'log.html': ('log.html.py', 'generate_html'),
+    'log_page': ('log.html.py', 'write_log_page'),
+    'messages': ('chat.html.py', 'get_messages'),
+    'search': ('search_index.py', 'search'),
+    'search_sync': ('search_index.py', 'sync_index'),
+}
+# search_index.py's database, kept up to date by PageGenerator like an output page
+SEARCH_DATABASE = os.path.join('.thimble', 'search.db')
+MESSAGES_DEFAULT_LIMIT = 50
+MESSAGES_MAX_LIMIT = 500
+SSE_KEEPALIVE = 15  # seconds between keepalive comments on idle message streams
+SSE_SEND_TIMEOUT = 5  # seconds before a stalled stream client is dropped
+HASHTAG_REGEX = re.compile(r'#\w+')
+WATCH_POLL_INTERVAL = 5  # seconds between message/ scans when inotify isn't available
+WATCH_SETTLE = 0.25  # seconds of quiet before a burst of message/ events, e.g. a git pull, becomes one bump
+# inotify event bits (linux/inotify.h)
+IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_ISDIR = 0x8, 0x40, 0x80, 0x100, 0x200, 0x40000000
+IN_Q_OVERFLOW = 0x4000  # the kernel queue filled up and events were dropped; arrives with wd -1
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+SERVER_MODES = ['threaded', 'asyncio']
+SCRIPT_POLICIES = ['preference', 'fastest', 'round-robin']
+DISPATCH_MODES = ['production', 'verify']
+TIMING_HISTORY = 20  # run times kept per script implementation
+VERIFY_DIFF_LINES = 40  # diff lines kept per mismatching implementation
+# scripts whose only effect is writing this output file, so verify mode can run every port side by side
+VERIFIABLE_OUTPUTS = {
+    'chat.html': 'chat.html',
+    'log.html': 'log.html',
+}
+DEFAULT_WORKERS = 8
+COMMIT_DELAY = 2  # seconds of quiet before queued messages are committed
+COMMIT_MAX_DELAY = 10  # upper bound on how long a burst can postpone its commit
+PUSH_DELAY = 30  # seconds after the last commit before pushing
+STREAM_BUFFER_SIZE = 16 * 1024  # bytes collected before a streamed chunk is sent
+COMPRESSIBLE_TYPES = {'text/plain', 'text/html', 'text/css', 'application/javascript', 'application/json'}
+GZIP_MIN_SIZE = 1024  # smaller files aren't worth compressing
+GZIP_CACHE_BYTES = 32 * 1024 * 1024  # memory for gzipped copies of static files
+PAGE_CACHE_BYTES = 16 * 1024 * 1024  # memory for rendered .txt message pages
+SENDFILE_MIN_SIZE = 256 * 1024  # larger uncompressed files go out with sendfile instead of being read into memory
 
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def __init__(self, *args, **kwargs):
@@ -45,10 +106,26 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.serve_static_file('index.html')
         elif self.path == '/log.html':
             self.generate_and_serve_report()
+        elif self.path.startswith('/log.html?'):
+            self.serve_log_page(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
         elif self.path == '/chat.html':
             self.generate_and_serve_chat()
         elif self.path == '/api/github_update':
             self.trigger_github_update()
+        elif self.path == '/api/server_status':
+            self.send_json(self.server.status())
+        elif self.path == '/api/commit_status':
+            self.send_json(self.server.commit_queue.status())
+        elif self.path == '/api/messages/stream':
+            self.stream_messages()
+        elif self.path == '/api/messages' or self.path.startswith('/api/messages?'):
+            self.serve_messages(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path == '/search' or self.path.startswith('/search?'):
+            self.serve_search(urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query))
+        elif self.path == '/api/scripts':
+            self.send_json(self.server.scripts.status())
+        elif self.path == '/api/cache_stats':
+            self.send_json({'page_cache': self.server.page_cache.stats(), 'gzip_cache': self.server.gzip_cache.stats()})
         elif self.path.endswith('.txt'):
             self.serve_text_file_as_html()
         else:
@@ -67,7 +144,16 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.send_header('Content-type', 'text/html')
         self.end_headers()
         self.wfile.write(b"Update triggered successfully")
-        self.run_script('github_update')
+        self.server.commit_queue.schedule_push()
+
+    def send_json(self, data, status: int = 200):
+        """Send a JSON response"""
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
     def handle_chat_post(self):
         """Handle POST request for chat messages"""
@@ -82,17 +168,71 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
             self.send_error(400, "Bad Request: Missing author or message")
             return
 
-        self.save_message(author, message)
+        filepath = self.save_message(author, message)
         self.send_response(302)
         self.send_header('Content-type', 'text/html')
         self.end_headers()
         self.wfile.write(b"Message saved successfully")
         self.wfile.write(b'<meta http-equiv="refresh" content="1;url=/chat.html">')
-        self.run_script('commit_files', 'message')
-        self.run_script('github_update')
+        self.server.commit_queue.enqueue(filepath)
 
-    def save_message(self, author: str, message: str):
-        """Save a chat message to a file"""
+    def serve_messages(self, query: dict):
+        """JSON list of messages newer than ?since=<cursor>, at most ?limit=N"""
+        get_messages = self.server.renderers.get('messages')
+        if get_messages is None:
+            self.send_error(503, "Message API unavailable")
+            return
+        try:
+            limit = int(query.get('limit', [str(MESSAGES_DEFAULT_LIMIT)])[0])
+            since = query.get('since', [None])[0]
+            if not 0 <= limit <= MESSAGES_MAX_LIMIT:
+                raise ValueError(limit)
+            if since is not None:
+                float(since.partition(':')[0])
+        except ValueError:
+            self.send_error(400, "Bad Request: Invalid limit or cursor")
+            return
+        self.send_json(get_messages(self.directory, since=since, limit=limit))
+
+    def serve_search(self, query: dict):
+        """JSON list of messages matching ?q=words&tag=hashtag&author=name, newest first"""
+        search = self.server.renderers.get('search')
+        sync = self.server.renderers.get('search_sync')
+        if search is None or sync is None:
+            self.send_error(503, "Search unavailable")
+            return
+        q = query.get('q', [''])[0]
+        tags = query.get('tag', [])
+        author = query.get('author', [''])[0]
+        try:
+            limit = int(query.get('limit', [str(MESSAGES_DEFAULT_LIMIT)])[0])
+            if not 0 <= limit <= MESSAGES_MAX_LIMIT:
+                raise ValueError(limit)
+        except ValueError:
+            self.send_error(400, "Bad Request: Invalid limit")
+            return
+        if not (q.strip() or tags or author.strip()):
+            self.send_error(400, "Bad Request: Missing q, tag or author")
+            return
+        # synced in the background after every bump; a query only waits when there is no index yet
+        self.server.pages.ensure(os.path.join(self.directory, SEARCH_DATABASE), lambda: sync(self.directory))
+        results = search(self.directory, q, tags, author, limit, refresh=False)
+        self.send_json({'results': results, 'count': len(results)})
+
+    def stream_messages(self):
+        """Server-Sent Events stream of new chat messages; the connection is handed to the broadcaster"""
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        # the socket leaves the worker pool, so open chat tabs don't tie up request workers
+        self.server.detach_request(self.connection)
+        self.server.broadcaster.subscribe(self.connection)
+        self.close_connection = True
+
+    def save_message(self, author: str, message: str) -> str:
+        """Save a chat message to a file and return its path once it is on disk"""
         timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
         title = self.generate_title(message)
         filename = f"{timestamp}_{title}.txt"
@@ -103,6 +243,18 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         filepath = os.path.join(message_dir, filename)
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(f"{message}\n\nAuthor: {author}")
+            f.flush()
+            os.fsync(f.fileno())
+        self.server.watcher.written(filepath)
+        self.server.pages.bump()
+        self.server.broadcaster.publish({
+            'author': author,
+            'content': message,
+            'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+            'hashtags': HASHTAG_REGEX.findall(message),
+            'path': os.path.relpath(filepath, self.directory),
+        })
+        return filepath
 
     def generate_title(self, message: str) -> str:
         """Generate a title for the message file"""
@@ -119,56 +271,95 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         self.run_script_if_needed('log.html', 'log.html')
         self.serve_static_file('log.html')
 
+    def serve_log_page(self, query: dict):
+        """Serve one page of the log, selected by ?page=N or ?before=<cursor>"""
+        renderer = self.server.renderers.get('log_page')
+        if renderer is None:
+            self.generate_and_serve_report()
+            return
+        try:
+            page = int(query.get('page', ['0'])[0])
+            before = query.get('before', [None])[0]
+            if page < 0:
+                raise ValueError(page)
+            if before is not None:
+                float(before.partition(':')[0])
+        except ValueError:
+            self.send_error(400, "Bad Request: Invalid page or cursor")
+            return
+        with self.start_stream('text/html; charset=utf-8') as out:
+            renderer(self.directory, out, page=page, before=before)
+
+    def start_stream(self, content_type: str) -> 'StreamWriter':
+        """Send headers for a response whose length isn't known up front and return a writer for the body"""
+        # chunked encoding needs an HTTP/1.1 status line; older clients get a body delimited by closing the connection
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        return StreamWriter(self.wfile, chunked)
+
     def generate_and_serve_chat(self):
         """Generate and serve the chat page"""
         self.run_script_if_needed('chat.html', 'chat.html')
         self.serve_static_file('chat.html')
 
     def run_script_if_needed(self, output_filename: str, script_name: str):
-        """Run a script if the output file doesn't exist or is outdated"""
+        """Make sure the output file can be served; a stale copy is served while it is rebuilt in the background"""
         output_filepath = os.path.join(self.directory, output_filename)
-        if not os.path.exists(output_filepath) or \
-           time.time() - os.path.getmtime(output_filepath) > 60:
-            print(f"Generating {output_filename}...")
+        self.server.pages.ensure(output_filepath, lambda: self.generate_page(output_filename, script_name, output_filepath))
+
+    def generate_page(self, output_filename: str, script_name: str, output_filepath: str):
+        """Regenerate an output file, in-process when possible"""
+        print(f"Generating {output_filename}...")
+        # verify mode compares the ports, so it always goes through run_script
+        if self.server.scripts.dispatch == 'verify' or not self.render_in_process(script_name, output_filepath):
             self.run_script(script_name)
 
+    def render_in_process(self, script_name: str, output_filepath: str) -> bool:
+        """Call a preloaded Python renderer; returns False if the caller should fall back to run_script"""
+        renderer = getattr(self.server, 'renderers', {}).get(script_name)
+        if renderer is None:
+            return False
+        start_time = time.time()
+        try:
+            renderer(self.directory, output_filepath)
+        except Exception as e:
+            print(f"In-process {script_name} failed ({e}), falling back to subprocess")
+            return False
+        print(f"Rendered {script_name} in-process in {(time.time() - start_time) * 1000:.1f} ms")
+        return True
+
     def run_script(self, script_name: str, *args):
         """Run a script with the appropriate interpreter"""
-        found_scripts = self.find_scripts(script_name)
-
-        if not found_scripts:
-            print(f"No scripts found for {script_name}")
-            return
-
-        for script_path, script_type in found_scripts:
-            interpreter = INTERPRETER_MAP.get(script_type)
-            if interpreter:
-                subprocess.run([interpreter, script_path, *args], cwd=self.directory)
-
-    def find_scripts(self, script_name: str) -> List[Tuple[str, str]]:
-        """Find all scripts matching the given name"""
-        found_scripts = []
-        for template_dir in os.listdir(os.path.join(self.directory, 'template')):
-            for script_type in SCRIPT_TYPES:
-                script_path = os.path.join(self.directory, 'template', template_dir, f"{script_name}.{script_type}")
-                if os.path.exists(script_path):
-                    found_scripts.append((script_path, script_type))
-        return found_scripts
+        self.server.scripts.run(script_name, *args)
 
     def serve_text_file_as_html(self):
-        """Serve a text file as HTML"""
+        """Serve a text file as HTML, from the rendered page cache when the file is unchanged"""
         path = os.path.join(self.directory, self.path[1:])
         try:
-            with open(path, 'r', encoding='utf-8') as f:
-                content = f.read()
+            stat = os.stat(path)
+            # messages are effectively immutable, so path+mtime+size identifies the rendered page
+            key = (path, stat.st_mtime_ns, stat.st_size)
+            body = self.server.page_cache.get(key)
+            if body is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                escaped_content = html.escape(content)
+                body = self.generate_html_content(os.path.basename(path), escaped_content).encode('utf-8')
+                self.server.page_cache.put(key, body)
 
             self.send_response(200)
             self.send_header("Content-type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-
-            escaped_content = html.escape(content)
-            html_content = self.generate_html_content(os.path.basename(path), escaped_content)
-            self.wfile.write(html_content.encode('utf-8'))
+            self.wfile.write(body)
         except IOError:
             self.send_error(404, "File not found")
 
@@ -194,24 +385,876 @@ class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         """
 
     def serve_static_file(self, path: str):
-        """Serve a static file"""
+        """Serve a static file with cache validators, gzip and sendfile"""
         file_path = os.path.join(self.directory, path)
-        if os.path.isfile(file_path):
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+
+        content_type = self.get_content_type(file_path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        use_gzip = content_type in COMPRESSIBLE_TYPES and stat.st_size >= GZIP_MIN_SIZE and \
+            'gzip' in self.headers.get('Accept-Encoding', '')
+        if use_gzip:
+            etag = etag[:-1] + '-gz"'
+
+        if self.is_not_modified(etag, stat.st_mtime):
+            self.send_response(304)
+            self.send_validators(etag, stat.st_mtime, content_type in COMPRESSIBLE_TYPES)
+            self.end_headers()
+            return
+
+        if use_gzip:
+            content = self.get_gzipped(file_path, stat)
+        elif stat.st_size < SENDFILE_MIN_SIZE:
             with open(file_path, 'rb') as f:
                 content = f.read()
-            content_type = self.get_content_type(file_path)
-            self.send_response(200)
-            self.send_header('Content-type', content_type)
-            self.end_headers()
+        else:
+            content = None
+
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(content) if content is not None else stat.st_size))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_validators(etag, stat.st_mtime, content_type in COMPRESSIBLE_TYPES)
+        self.end_headers()
+
+        if content is not None:
             self.wfile.write(content)
         else:
-            self.send_error(404)
+            with open(file_path, 'rb') as f:
+                self.connection.sendfile(f, 0, stat.st_size)
+
+    def send_validators(self, etag: str, mtime: float, vary: bool):
+        """Send the headers a client needs to revalidate instead of re-downloading"""
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(mtime, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def is_not_modified(self, etag: str, mtime: float) -> bool:
+        """Check If-None-Match, then If-Modified-Since"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return since is not None and int(mtime) <= since.timestamp()
+        return False
+
+    def get_gzipped(self, file_path: str, stat: os.stat_result) -> bytes:
+        """Gzipped file content: a fresh precompressed .gz next to the file, else the in-memory cache"""
+        precompressed = file_path + '.gz'
+        try:
+            if os.stat(precompressed).st_mtime >= stat.st_mtime:
+                with open(precompressed, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        content = self.server.gzip_cache.get(key)
+        if content is None:
+            with open(file_path, 'rb') as f:
+                content = gzip.compress(f.read(), compresslevel=6)
+            self.server.gzip_cache.put(key, content)
+        return content
 
     def get_content_type(self, file_path: str) -> str:
         """Get the content type for a file"""
         ext = os.path.splitext(file_path)[1][1:].lower()
         return MIME_TYPES.get(ext, 'application/octet-stream')
 
+class StreamWriter:
+    """Text file-like object that sends what is written to a response body, optionally as HTTP chunks"""
+
+    def __init__(self, wfile, chunked: bool, buffer_size: int = STREAM_BUFFER_SIZE):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, text: str):
+        # small writes (one table row each) are batched so the client doesn't get tiny chunks
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = ''.join(self.buffer).encode('utf-8')
+        self.buffer = []
+        self.buffered = 0
+        if self.chunked:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # on error, leave out the terminating chunk so the client sees a truncated response
+        if exc_type is None:
+            self.close()
+
+class MessageBroadcaster:
+    """Pushes new messages as Server-Sent Events to every subscribed socket from one thread"""
+
+    def __init__(self, keepalive: float = SSE_KEEPALIVE):
+        self.keepalive = keepalive
+        self.subscribers = []
+        self.events = queue.Queue()
+        threading.Thread(target=self.run, name='thimble-broadcaster', daemon=True).start()
+
+    def subscribe(self, connection: socket.socket):
+        connection.settimeout(SSE_SEND_TIMEOUT)
+        self.events.put(('subscribe', connection))
+
+    def publish(self, message: dict):
+        self.events.put(('message', message))
+
+    def subscriber_count(self) -> int:
+        return len(self.subscribers)
+
+    def run(self):
+        while True:
+            try:
+                kind, item = self.events.get(timeout=self.keepalive)
+            except queue.Empty:
+                # comment lines keep proxies from timing out idle streams and reveal closed clients
+                self.send_all(b': keepalive\n\n')
+                continue
+            if kind == 'subscribe':
+                self.subscribers.append(item)
+                self.send_all(b': connected\n\n', [item])
+            else:
+                self.send_all(f"data: {json.dumps(item)}\n\n".encode('utf-8'))
+
+    def send_all(self, data: bytes, connections: list = None):
+        for connection in list(connections if connections is not None else self.subscribers):
+            try:
+                connection.sendall(data)
+            except OSError:
+                self.subscribers.remove(connection)
+                connection.close()
+
+class ByteLRUCache:
+    """Thread-safe LRU cache of bytes values, bounded by their total size"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def stats(self) -> dict:
+        """Report size and hit/miss/eviction counters"""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old_value = self.entries.pop(key, None)
+            if old_value is not None:
+                self.size -= len(old_value)
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+class BoundedThreadPoolServer(socketserver.TCPServer):
+    """TCP server that hands accepted connections to a fixed-size worker pool"""
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers: int = DEFAULT_WORKERS):
+        self.mode = 'threaded'
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thimble-worker')
+        self.status_lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.handled = 0
+        self.renderers = {}
+        self.scripts = None
+        self.commit_queue = None
+        self.watcher = None
+        self.pages = PageGenerator()
+        self.broadcaster = MessageBroadcaster()
+        self.detached = set()
+        self.gzip_cache = ByteLRUCache(GZIP_CACHE_BYTES)
+        self.page_cache = ByteLRUCache(PAGE_CACHE_BYTES)
+        super().__init__(server_address, handler_class)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for the worker pool instead of handling it inline"""
+        with self.status_lock:
+            self.queued += 1
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request, client_address):
+        """Handle one connection on a pool thread"""
+        with self.status_lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.status_lock:
+                self.active -= 1
+                self.handled += 1
+
+    def detach_request(self, request):
+        """Keep the worker from closing this connection; whoever detached it now owns it"""
+        with self.status_lock:
+            self.detached.add(request)
+
+    def shutdown_request(self, request):
+        with self.status_lock:
+            if request in self.detached:
+                self.detached.discard(request)
+                return
+        super().shutdown_request(request)
+
+    def status(self) -> dict:
+        """Report pool size and queue depth"""
+        with self.status_lock:
+            return {
+                'mode': self.mode,
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self.queued,
+                'handled': self.handled,
+                'streams': self.broadcaster.subscriber_count(),
+            }
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class AsyncioPoolServer(BoundedThreadPoolServer):
+    """Accepts connections on an asyncio event loop; handlers still run in the worker pool"""
+
+    def __init__(self, server_address, handler_class, workers: int = DEFAULT_WORKERS):
+        super().__init__(server_address, handler_class, workers)
+        self.mode = 'asyncio'
+        self.stop_requested = threading.Event()
+        self.stopped = threading.Event()
+        self.stopped.set()
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """Accept connections until shutdown() is called"""
+        self.stop_requested.clear()
+        self.stopped.clear()
+        try:
+            asyncio.run(self.accept_loop(poll_interval))
+        finally:
+            self.stopped.set()
+
+    def shutdown(self):
+        """Stop serve_forever and wait for it to return; call it from another thread, as with BaseServer"""
+        self.stop_requested.set()
+        self.stopped.wait()
+
+    async def accept_loop(self, poll_interval: float):
+        loop = asyncio.get_running_loop()
+        self.socket.setblocking(False)
+        while not self.stop_requested.is_set():
+            try:
+                # wake up every poll_interval to check for shutdown(), like BaseServer.serve_forever
+                request, client_address = await asyncio.wait_for(loop.sock_accept(self.socket), poll_interval)
+            except asyncio.TimeoutError:
+                self.service_actions()
+                continue
+            request.setblocking(True)
+            if self.verify_request(request, client_address):
+                self.process_request(request, client_address)
+            else:
+                self.shutdown_request(request)
+            self.service_actions()
+
+SERVER_CLASSES = dict(zip(SERVER_MODES, [BoundedThreadPoolServer, AsyncioPoolServer]))
+
+class ScriptRegistry:
+    """Maps script names to their implementations; scanned once and rescanned when a template directory changes"""
+
+    def __init__(self, directory: str, policy: str = 'preference', order: List[str] = SCRIPT_TYPES,
+                 dispatch: str = 'production'):
+        self.directory = directory
+        self.policy = policy
+        self.order = list(order)
+        self.dispatch = dispatch
+        self.lock = threading.Lock()
+        self.available_types = [t for t in SCRIPT_TYPES if shutil.which(INTERPRETER_MAP[t])]
+        self.scripts = {}
+        self.dir_mtimes = {}
+        self.timings = {}
+        self.next_index = {}
+        self.verifications = {}
+        self.scan()
+
+    def scan(self):
+        """Index template/<language>/<name>.<ext> for every extension with an installed interpreter"""
+        template_root = os.path.join(self.directory, 'template')
+        scripts = {}
+        dir_mtimes = {template_root: os.stat(template_root).st_mtime_ns}
+        for template_dir in sorted(os.scandir(template_root), key=lambda entry: entry.name):
+            if not template_dir.is_dir():
+                continue
+            dir_mtimes[template_dir.path] = template_dir.stat().st_mtime_ns
+            for entry in os.scandir(template_dir.path):
+                script_name, _, script_type = entry.name.rpartition('.')
+                if script_name and script_type in self.available_types:
+                    scripts.setdefault(script_name, []).append((entry.path, script_type))
+        for found_scripts in scripts.values():
+            found_scripts.sort(key=self.preference_rank)
+        self.scripts = scripts
+        self.dir_mtimes = dir_mtimes
+
+    def preference_rank(self, script: Tuple[str, str]) -> int:
+        """Position of the script's language in the preference order; unlisted languages go last"""
+        script_type = script[1]
+        return self.order.index(script_type) if script_type in self.order else len(self.order)
+
+    def refresh_if_changed(self):
+        """Rescan if a script was added or removed; costs one stat per template directory"""
+        for path, mtime in self.dir_mtimes.items():
+            try:
+                changed = os.stat(path).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.scan()
+                return
+
+    def find(self, script_name: str) -> List[Tuple[str, str]]:
+        """All available implementations of a script"""
+        with self.lock:
+            self.refresh_if_changed()
+            return list(self.scripts.get(script_name, []))
+
+    def select(self, script_name: str):
+        """Pick one implementation according to the selection policy"""
+        found_scripts = self.find(script_name)
+        if not found_scripts:
+            return None
+        with self.lock:
+            if self.policy == 'round-robin':
+                index = self.next_index.get(script_name, 0)
+                self.next_index[script_name] = index + 1
+                return found_scripts[index % len(found_scripts)]
+            if self.policy == 'fastest':
+                # implementations that haven't been timed yet are tried first
+                return min(found_scripts, key=lambda script: self.average_time(script[0]))
+        # 'preference': implementations are sorted by the preference order
+        return found_scripts[0]
+
+    def average_time(self, script_path: str) -> float:
+        history = self.timings.get(script_path)
+        return sum(history) / len(history) if history else -1.0
+
+    def record_time(self, script_path: str, seconds: float):
+        with self.lock:
+            self.timings.setdefault(script_path, deque(maxlen=TIMING_HISTORY)).append(seconds)
+
+    def run(self, script_name: str, *args):
+        """Run a script: one implementation in production, every implementation in verify mode
+
+        Returns the CompletedProcess of a production run, None if no implementation ran or in verify mode.
+        """
+        if self.dispatch == 'verify' and script_name in VERIFIABLE_OUTPUTS:
+            self.verify(script_name, *args)
+            return None
+
+        script = self.select(script_name)
+        if script is None:
+            print(f"No scripts found for {script_name}")
+            return None
+        return self.run_implementation(script, self.directory, *args)
+
+    def run_implementation(self, script: Tuple[str, str], cwd: str, *args, capture_output: bool = False):
+        """Run one implementation and add its run time to the timing history"""
+        script_path, script_type = script
+        start_time = time.time()
+        result = subprocess.run([INTERPRETER_MAP[script_type], script_path, *args], cwd=cwd, capture_output=capture_output)
+        self.record_time(script_path, time.time() - start_time)
+        return result
+
+    def verify(self, script_name: str, *args):
+        """Run every implementation in parallel, diff their outputs against the preferred one and keep the preferred output"""
+        found_scripts = self.find(script_name)
+        if not found_scripts:
+            print(f"No scripts found for {script_name}")
+            return
+        output_filename = VERIFIABLE_OUTPUTS[script_name]
+        reference = self.select(script_name)
+
+        with ThreadPoolExecutor(max_workers=len(found_scripts)) as executor:
+            outputs = list(executor.map(lambda script: self.run_in_scratch_dir(script, output_filename, *args), found_scripts))
+        outputs = dict(zip(found_scripts, outputs))
+
+        reference_output = outputs[reference]
+        results = {}
+        for (script_path, _), output in outputs.items():
+            if output is None:
+                results[script_path] = {'status': 'no output'}
+            elif reference_output is None or output == reference_output:
+                results[script_path] = {'status': 'match' if reference_output is not None else 'reference missing'}
+            else:
+                diff = list(difflib.unified_diff(reference_output.splitlines(), output.splitlines(),
+                                                 reference[0], script_path, lineterm='', n=0))
+                results[script_path] = {'status': 'differs', 'diff_lines': len(diff), 'diff': diff[:VERIFY_DIFF_LINES]}
+                print(f"verify {script_name}: {script_path} differs from {reference[0]} ({len(diff)} diff lines)")
+        with self.lock:
+            self.verifications[script_name] = {
+                'reference': reference[0],
+                'time': datetime.now().isoformat(timespec='seconds'),
+                'results': results,
+            }
+
+        if reference_output is not None:
+            with atomic_write(os.path.join(self.directory, output_filename)) as f:
+                f.write(reference_output)
+
+    def run_in_scratch_dir(self, script: Tuple[str, str], output_filename: str, *args):
+        """Run an implementation in a directory that links to everything but the output file; returns what it wrote"""
+        scratch_dir = tempfile.mkdtemp(prefix='thimble-verify-')
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name != output_filename:
+                    os.symlink(entry.path, os.path.join(scratch_dir, entry.name))
+            self.run_implementation(script, scratch_dir, *args, capture_output=True)
+            output_filepath = os.path.join(scratch_dir, output_filename)
+            if not os.path.isfile(output_filepath):
+                return None
+            with open(output_filepath, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        finally:
+            # rmtree removes the links themselves, never what they point to
+            shutil.rmtree(scratch_dir)
+
+    def status(self) -> dict:
+        """Timing history per implementation and the latest verification results"""
+        with self.lock:
+            scripts = {}
+            for script_name, found_scripts in self.scripts.items():
+                timed = [script for script in found_scripts if script[0] in self.timings]
+                if timed:
+                    scripts[script_name] = [{
+                        'path': script_path,
+                        'type': script_type,
+                        'average': self.average_time(script_path),
+                        'history': list(self.timings[script_path]),
+                    } for script_path, script_type in timed]
+            return {
+                'policy': self.policy,
+                'order': self.order,
+                'dispatch': self.dispatch,
+                'scripts': scripts,
+                'verifications': dict(self.verifications),
+            }
+
+class PageGenerator:
+    """Single-flight regeneration of output pages, driven by a message generation counter
+
+    bump() is called whenever messages may have changed (save_message, commit_files,
+    or the message/ watcher). A page is rebuilt only when the generation moved since
+    it was last built, so an idle server does no regeneration work. Only one rebuild
+    per page runs at a time; requests that find an existing copy serve it immediately,
+    and only requests for a page that doesn't exist yet wait for the rebuild.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 1
+        self.pages = {}
+
+    def bump(self):
+        """Record that messages changed and start rebuilding every page that has been served"""
+        with self.lock:
+            self.generation += 1
+            for state in self.pages.values():
+                self.start_rebuild(state)
+
+    def ensure(self, output_filepath: str, build):
+        """Start a rebuild if the page is out of date, and wait for it only if there is nothing to serve yet"""
+        with self.lock:
+            # pages start at generation 0 so the first request after startup refreshes whatever is on disk
+            state = self.pages.setdefault(output_filepath, {'generation': 0, 'building': None})
+            state['build'] = build
+            exists = os.path.exists(output_filepath)
+            if exists and state['generation'] == self.generation:
+                return
+            building = self.start_rebuild(state)
+        if not exists:
+            building.wait()
+
+    def start_rebuild(self, state: dict) -> threading.Event:
+        """Start a rebuild unless one is already running; called with the lock held"""
+        if state['building'] is None:
+            state['building'] = threading.Event()
+            threading.Thread(target=self.rebuild, args=(state,),
+                             name='thimble-page-rebuild', daemon=True).start()
+        return state['building']
+
+    def rebuild(self, state: dict):
+        while True:
+            with self.lock:
+                generation = self.generation
+            try:
+                state['build']()
+            except Exception as e:
+                # the page keeps its old generation, so the next request retries
+                print(f"Page rebuild failed: {e}")
+                generation = None
+            with self.lock:
+                if generation is not None:
+                    state['generation'] = generation
+                # messages that arrived during the build need another pass
+                if generation is None or generation == self.generation:
+                    building, state['building'] = state['building'], None
+                    building.set()
+                    return
+
+class MessageWatcher:
+    """Bumps the page generation when message files change on disk, e.g. after a git pull
+
+    Uses inotify where available and falls back to polling the (mtime, size) of every
+    message file. A burst of changes becomes one bump, and files the server wrote itself
+    are skipped, since save_message has already bumped for them.
+    """
+
+    def __init__(self, directory: str, pages: PageGenerator, poll_interval: float = WATCH_POLL_INTERVAL):
+        self.message_dir = os.path.abspath(os.path.join(directory, 'message'))
+        self.pages = pages
+        self.poll_interval = poll_interval
+        self.watches = {}
+        # {path: (mtime_ns, size)} of message files saved by this server
+        self.own_writes = {}
+        self.lock = threading.Lock()
+        try:
+            self.fd = self.init_inotify()
+            target = self.watch_inotify
+        except OSError as e:
+            print(f"inotify unavailable ({e}), polling {self.message_dir} every {poll_interval}s")
+            target = self.watch_polling
+        threading.Thread(target=target, name='thimble-message-watcher', daemon=True).start()
+
+    def written(self, filepath: str):
+        """Record a message file the server saved and bumped for, so its events don't bump again"""
+        stat = os.stat(filepath)
+        with self.lock:
+            self.own_writes[os.path.abspath(filepath)] = (stat.st_mtime_ns, stat.st_size)
+
+    def is_own_write(self, path: str) -> bool:
+        """True if path is still exactly as the server saved it"""
+        with self.lock:
+            version = self.own_writes.pop(path, None)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return version == (stat.st_mtime_ns, stat.st_size)
+
+    def notify(self, changed_paths):
+        if any(not self.is_own_write(path) for path in changed_paths):
+            self.pages.bump()
+
+    def init_inotify(self) -> int:
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError('not a Linux libc')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # message/ may not exist yet in a fresh repo, so its parent is watched for it appearing
+        self.parent_wd = self.libc.inotify_add_watch(fd, os.path.dirname(self.message_dir).encode(), IN_CREATE | IN_MOVED_TO)
+        if self.parent_wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+        self.add_watches(fd, self.message_dir)
+        return fd
+
+    def add_watches(self, fd: int, top: str) -> List[str]:
+        """inotify isn't recursive, so every directory under message/ gets its own watch
+
+        Returns the message files already in the new directories, which were written
+        before their watch existed and so produce no events of their own.
+        """
+        existing = []
+        for root, _, files in os.walk(top):
+            wd = self.libc.inotify_add_watch(fd, root.encode(), INOTIFY_MASK)
+            if wd >= 0:
+                self.watches[wd] = root
+            existing.extend(os.path.join(root, file) for file in files if file.endswith('.txt'))
+        return existing
+
+    def watch_inotify(self):
+        header = struct.Struct('iIII')
+        while True:
+            changed = set()
+            overflowed = False
+            timeout = None
+            # block for the first event, then keep reading until message/ has been quiet for WATCH_SETTLE
+            while select.select([self.fd], [], [], timeout)[0]:
+                data = os.read(self.fd, 64 * 1024)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, _, name_length = header.unpack_from(data, offset)
+                    name = data[offset + header.size:offset + header.size + name_length].rstrip(b'\0').decode(errors='replace')
+                    offset += header.size + name_length
+                    if mask & IN_Q_OVERFLOW:
+                        # events were lost, so anything may have changed, including new directories
+                        overflowed = True
+                        self.add_watches(self.fd, self.message_dir)
+                        continue
+                    if wd == self.parent_wd:
+                        if mask & IN_ISDIR and name == os.path.basename(self.message_dir):
+                            changed.update(self.add_watches(self.fd, self.message_dir))
+                        continue
+                    if wd not in self.watches:
+                        continue
+                    path = os.path.join(self.watches[wd], name)
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            changed.update(self.add_watches(self.fd, path))
+                        else:
+                            changed.add(path)
+                    elif name.endswith('.txt'):
+                        changed.add(path)
+                timeout = WATCH_SETTLE
+            if overflowed:
+                self.pages.bump()
+            else:
+                self.notify(changed)
+
+    def snapshot(self) -> dict:
+        """{path: (mtime_ns, size)} for every message file"""
+        files = {}
+        for root, _, names in os.walk(self.message_dir):
+            for name in names:
+                if name.endswith('.txt'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def watch_polling(self):
+        last_snapshot = self.snapshot()
+        while True:
+            time.sleep(self.poll_interval)
+            snapshot = self.snapshot()
+            self.notify([path for path in snapshot.keys() | last_snapshot.keys()
+                         if snapshot.get(path) != last_snapshot.get(path)])
+            last_snapshot = snapshot
+
+class CommitQueue:
+    """Write-behind queue that coalesces saved messages into commits and debounces pushes"""
+
+    def __init__(self, scripts: 'ScriptRegistry', pages: PageGenerator, commit_delay: float = COMMIT_DELAY,
+                 push_delay: float = PUSH_DELAY):
+        self.scripts = scripts
+        self.pages = pages
+        self.commit_delay = commit_delay
+        self.push_delay = push_delay
+        self.condition = threading.Condition()
+        self.pending = []
+        self.first_enqueued = None
+        self.last_enqueued = None
+        self.push_at = None
+        self.unpushed = 0
+        self.counts = {'pending': 0, 'committed': 0, 'pushed': 0, 'commits': 0, 'pushes': 0,
+                       'commit_failures': 0, 'push_failures': 0}
+        self.stopping = False
+        self.last_commit_time = None
+        self.last_push_time = None
+        self.thread = threading.Thread(target=self.worker, name='thimble-commit-queue', daemon=True)
+        self.thread.start()
+
+    def enqueue(self, filepath: str):
+        """Queue a durably written message file for the next commit"""
+        with self.condition:
+            now = time.time()
+            if not self.pending:
+                self.first_enqueued = now
+            self.last_enqueued = now
+            self.pending.append(filepath)
+            self.counts['pending'] = len(self.pending)
+            self.condition.notify()
+
+    def schedule_push(self, delay: float = 0):
+        """Ask for a push no later than delay seconds from now"""
+        with self.condition:
+            push_at = time.time() + delay
+            if self.push_at is None or push_at < self.push_at:
+                self.push_at = push_at
+            self.condition.notify()
+
+    def status(self) -> dict:
+        """Report pending/committed/pushed counts"""
+        with self.condition:
+            return dict(self.counts, unpushed=self.unpushed,
+                        last_commit_time=self.last_commit_time, last_push_time=self.last_push_time)
+
+    def next_deadline(self):
+        """Time at which the worker has something to do, or None if idle"""
+        deadlines = []
+        if self.pending:
+            deadlines.append(min(self.last_enqueued + self.commit_delay, self.first_enqueued + COMMIT_MAX_DELAY))
+        if self.push_at is not None:
+            deadlines.append(self.push_at)
+        return min(deadlines) if deadlines else None
+
+    def wait_for_work(self) -> Tuple[list, bool, bool]:
+        """Block until a batch is ready to commit, a push is due or flush() asks the worker to stop"""
+        with self.condition:
+            while True:
+                if self.stopping:
+                    batch, self.pending = self.pending, []
+                    self.counts['pending'] = 0
+                    return batch, False, True
+                deadline = self.next_deadline()
+                now = time.time()
+                if deadline is not None and now >= deadline:
+                    break
+                self.condition.wait(None if deadline is None else deadline - now)
+            if self.pending and now >= min(self.last_enqueued + self.commit_delay, self.first_enqueued + COMMIT_MAX_DELAY):
+                batch, self.pending = self.pending, []
+                self.counts['pending'] = 0
+                return batch, False, False
+            return [], True, False
+
+    def worker(self):
+        while True:
+            batch, push, stop = self.wait_for_work()
+            if batch:
+                self.commit(batch)
+            if stop:
+                if self.unpushed:
+                    self.push()
+                return
+            if push:
+                self.push()
+
+    def commit(self, batch: list):
+        """Commit a batch of messages with a single commit_files run"""
+        print(f"Committing {len(batch)} queued message(s)...")
+        result = self.scripts.run('commit_files', 'message')
+        if result is None or result.returncode != 0:
+            # the files stay uncommitted on disk, so the next commit_files run picks them up
+            print(f"Commit of {len(batch)} message(s) failed")
+            with self.condition:
+                self.counts['commit_failures'] += 1
+            return
+        # log.html shows commit times, so a commit changes what the pages should contain
+        self.pages.bump()
+        with self.condition:
+            self.counts['committed'] += len(batch)
+            self.counts['commits'] += 1
+            self.unpushed += len(batch)
+            self.last_commit_time = datetime.now().isoformat(timespec='seconds')
+        self.schedule_push(self.push_delay)
+
+    def push(self):
+        """Push everything committed so far"""
+        with self.condition:
+            self.push_at = None
+            unpushed = self.unpushed
+        result = self.scripts.run('github_update')
+        if result is None or result.returncode != 0:
+            print(f"Push failed, retrying in {self.push_delay}s")
+            with self.condition:
+                self.counts['push_failures'] += 1
+            self.schedule_push(self.push_delay)
+            return
+        with self.condition:
+            self.counts['pushed'] += unpushed
+            self.counts['pushes'] += 1
+            self.unpushed -= unpushed
+            self.last_push_time = datetime.now().isoformat(timespec='seconds')
+
+    def flush(self):
+        """Commit and push anything still queued, e.g. on shutdown
+
+        The worker does the work, so it can't overlap with a commit it is already running.
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.thread.join()
+
+def load_in_process_renderers(directory: str) -> dict:
+    """Import the Python page generators once so requests don't spawn an interpreter"""
+    renderers = {}
+    modules = {}
+    python_template_dir = os.path.join(directory, 'template', 'python3')
+    if python_template_dir not in sys.path:
+        # the renderers import shared helpers such as message_index from their own directory
+        sys.path.insert(0, python_template_dir)
+    for script_name, (filename, function_name) in IN_PROCESS_RENDERERS.items():
+        script_path = os.path.join(python_template_dir, filename)
+        module_name = 'thimble_' + filename[:-len('.py')].replace('.', '_')
+        try:
+            if filename not in modules:
+                spec = importlib.util.spec_from_file_location(module_name, script_path)
+                module = importlib.util.module_from_spec(spec)
+                # registered so multiprocessing workers can pickle the module's functions
+                sys.modules[module_name] = module
+                spec.loader.exec_module(module)
+                modules[filename] = module
+            renderers[script_name] = getattr(modules[filename], function_name)
+        except Exception as e:
+            print(f"In-process renderer for {script_name} unavailable ({e}), using subprocess")
+    return renderers
+
 def is_port_in_use(port: int) -> bool:
     """Check if a port is already in use"""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -224,14 +1267,25 @@ def find_available_port(start_port: int) -> int:
         port += 1
     return port
 
-def run_server(port: int, directory: str) -> bool:
+def run_server(port: int, directory: str, mode: str = 'threaded', workers: int = DEFAULT_WORKERS,
+               commit_delay: float = COMMIT_DELAY, push_delay: float = PUSH_DELAY, script_policy: str = 'preference',
+               script_order: List[str] = SCRIPT_TYPES, dispatch: str = 'production') -> bool:
     """Run the HTTP server"""
     os.chdir(directory)
     handler = CustomHTTPRequestHandler
+    server_class = SERVER_CLASSES[mode]
     try:
-        with socketserver.TCPServer(("", port), handler) as httpd:
-            print(f"Serving HTTP on 0.0.0.0 port {port} (http://0.0.0.0:{port}/) ...")
-            httpd.serve_forever()
+        with server_class(("", port), handler, workers=workers) as httpd:
+            httpd.renderers = load_in_process_renderers(directory)
+            httpd.scripts = ScriptRegistry(directory, script_policy, script_order, dispatch)
+            httpd.commit_queue = CommitQueue(httpd.scripts, httpd.pages, commit_delay, push_delay)
+            httpd.watcher = MessageWatcher(directory, httpd.pages)
+            print(f"Serving HTTP on 0.0.0.0 port {port} (http://0.0.0.0:{port}/) with {workers} {mode} workers ...")
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                print("Shutting down, flushing queued commits...")
+                httpd.commit_queue.flush()
     except OSError as e:
         if e.errno == 98:  # Address already in use
             print(f"Port {port} is already in use.")
@@ -242,6 +1296,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run a simple HTTP server.")
     parser.add_argument('-p', '--port', type=int, default=8000, help='Port to serve on (default: 8000)')
     parser.add_argument('-d', '--directory', type=str, default=os.getcwd(), help='Directory to serve (default: current directory)')
+    parser.add_argument('-m', '--mode', choices=SERVER_MODES, default='threaded', help='Connection handling mode (default: threaded)')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS, help=f'Number of request worker threads (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--commit-delay', type=float, default=COMMIT_DELAY, help=f'Seconds of quiet before queued messages are committed (default: {COMMIT_DELAY})')
+    parser.add_argument('--push-delay', type=float, default=PUSH_DELAY, help=f'Seconds after a commit before pushing (default: {PUSH_DELAY})')
+    parser.add_argument('--script-policy', choices=SCRIPT_POLICIES, default='preference', help='Which implementation of a script to run (default: preference)')
+    parser.add_argument('--script-order', type=str, default=','.join(SCRIPT_TYPES), help=f'Preferred script languages, most preferred first (default: {",".join(SCRIPT_TYPES)})')
+    parser.add_argument('--dispatch', choices=DISPATCH_MODES, default='production', help='production runs one implementation per task; verify runs all page generators in parallel and diffs their output (default: production)')
 
     args = parser.parse_args()
 
@@ -250,6 +1311,7 @@ if __name__ == "__main__":
         args.port = find_available_port(args.port + 1)
         print(f"Trying port {args.port}...")
 
-    run_server(args.port, args.directory)
+    run_server(args.port, args.directory, args.mode, args.workers, args.commit_delay, args.push_delay, args.script_policy,
+               args.script_order.split(','), args.dispatch)
 
 # end of start_server.py
\ No newline at end of file
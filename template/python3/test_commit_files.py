@@ -41,6 +41,26 @@ def check_metadata_file(filename: str) -> None:
 		metadata = json.load(f)
 	return all(key in metadata for key in ['author', 'title', 'hashtags', 'file_hash'])
 
+def check_metadata_store(filename: str) -> bool:
+	store_file = os.path.join(os.path.dirname(filename), "metadata.jsonl")
+	if not os.path.exists(store_file):
+		return False
+	with open(store_file, 'r') as f:
+		records = {record['name']: record for record in map(json.loads, f)}
+	record = records.get(os.path.basename(filename))
+	return record is not None and all(key in record for key in ['author', 'title', 'hashtags', 'file_hash'])
+
+def check_committed(filename: str, test_repo_dir: str) -> bool:
+	"""True if HEAD has filename exactly as it is on disk, or doesn't have it if it was deleted"""
+	relative_path = os.path.relpath(filename, test_repo_dir)
+	in_head = subprocess.run(["git", "ls-tree", "--name-only", "HEAD", "--", relative_path], cwd=test_repo_dir, capture_output=True, text=True).stdout.strip()
+	status = subprocess.run(["git", "status", "--porcelain", "--", relative_path], cwd=test_repo_dir, capture_output=True, text=True).stdout.strip()
+	return not status and bool(in_head) == os.path.exists(filename)
+
+def check_clean(test_repo_dir: str) -> bool:
+	status = subprocess.run(["git", "status", "--porcelain"], cwd=test_repo_dir, capture_output=True, text=True).stdout.strip()
+	return not status
+
 def set_up() -> str:
 	test_repo_dir = f"test-repo-{random_string()}"
 	subprocess.run(["/bin/sh", "./bin/init_message_repo.sh", test_repo_dir])
@@ -76,6 +96,101 @@ def run_tests(script: str, test_repo_dir: str) -> None:
 
 	print(f"All tests passed for {script}")
 
+def run_plumbing_tests(script: str, test_repo_dir: str) -> None:
+	"""--plumbing and --files, which only commit_files.py has"""
+
+	print(f"Testing {script} --plumbing")
+
+	# Test 4: Commit with git plumbing
+	file4 = create_test_file("Author: Ada Lovelace\nPlumbing\n\nWritten without git add or git commit.\n\n#plumbing", test_repo_dir)
+	run_commit_files(f"{script} --plumbing")
+	assert check_git_log(test_repo_dir), "Git commit not found"
+	assert check_metadata_file(file4), "Metadata file not created or invalid"
+	assert check_committed(file4, test_repo_dir) and check_clean(test_repo_dir), "Plumbing commit left changes behind"
+	print("Test 4 passed: Plumbing commit")
+
+	# Test 5: Commit only the files named with --files
+	file5 = create_test_file("Author: Grace Hopper\nNamed\n\nListed on the command line.", test_repo_dir)
+	file6 = create_test_file("Author: Grace Hopper\nUnnamed\n\nNot listed on the command line.", test_repo_dir)
+	run_commit_files(f"{script} --plumbing --files {os.path.relpath(file5, test_repo_dir)}")
+	assert check_committed(file5, test_repo_dir), "Named file not committed"
+	assert not check_committed(file6, test_repo_dir), "Unnamed file committed"
+	run_commit_files(f"{script} --files {os.path.relpath(file6, test_repo_dir)}")
+	assert check_committed(file6, test_repo_dir) and check_clean(test_repo_dir), "Named file not committed without --plumbing"
+	print("Test 5 passed: --files")
+
+	# Test 6: Deleted files are committed as deletions, without errors
+	os.remove(file4)
+	os.remove(file5)
+	output = subprocess.run(f"{script} --plumbing", shell=True, check=True, capture_output=True, text=True).stdout
+	assert "Error" not in output, f"Deleted files reported as errors: {output}"
+	assert check_committed(file4, test_repo_dir) and check_committed(file5, test_repo_dir), "Deletions not committed"
+	os.remove(file6)
+	output = subprocess.run(script, shell=True, check=True, capture_output=True, text=True).stdout
+	assert "Error" not in output and check_committed(file6, test_repo_dir), "Deletion not committed without --plumbing"
+	print("Test 6 passed: Deleted files")
+
+	print(f"All --plumbing tests passed for {script}")
+
+def run_sidecar_skip_tests(script: str, test_repo_dir: str) -> None:
+	"""Sidecars are only rewritten when a file's contents change"""
+
+	print(f"Testing {script} sidecar skipping")
+
+	# Test 7: A touched but unedited file keeps its sidecar
+	file7 = create_test_file("Author: Edsger Dijkstra\nTouched\n\nRead again, but not rewritten.", test_repo_dir)
+	run_commit_files(script)
+	metadata_file = os.path.join(os.path.dirname(file7), "metadata", os.path.basename(file7) + ".json")
+	metadata_mtime = os.stat(metadata_file).st_mtime_ns
+	os.utime(file7)
+	run_commit_files(f"{script} --files {os.path.relpath(file7, test_repo_dir)}")
+	assert os.stat(metadata_file).st_mtime_ns == metadata_mtime, "Sidecar rewritten for a touched file"
+	print("Test 7 passed: Touched file skipped")
+
+	# Test 8: An edited file gets a new sidecar
+	with open(file7, 'a') as f:
+		f.write("\n#edited")
+	run_commit_files(script)
+	with open(metadata_file, 'r') as f:
+		assert "#edited" in json.load(f)['hashtags'], "Sidecar not updated for an edited file"
+	assert check_clean(test_repo_dir), "Edited file or sidecar not committed"
+	print("Test 8 passed: Edited file updated")
+
+	print(f"All sidecar skipping tests passed for {script}")
+
+def run_metadata_store_tests(script: str, test_repo_dir: str) -> None:
+	"""--metadata-store, and the metadata.jsonl stores it leaves behind"""
+
+	print(f"Testing {script} --metadata-store")
+
+	# Test 9: Metadata goes to the directory's metadata.jsonl
+	file9 = create_test_file("Author: Alan Turing\nStored\n\nOne line of metadata.jsonl.\n\n#store", test_repo_dir)
+	run_commit_files(f"{script} --metadata-store")
+	assert check_metadata_store(file9) and not check_metadata_file(file9), "Metadata not written to metadata.jsonl"
+	assert check_clean(test_repo_dir), "metadata.jsonl not committed"
+	print("Test 9 passed: Metadata store")
+
+	# Test 10: Later runs keep using an existing store, with or without the flag
+	file10 = create_test_file("Author: Alan Turing\nStored again\n\nNo --metadata-store this time.", test_repo_dir)
+	run_commit_files(f"{script} --plumbing")
+	assert check_metadata_store(file10) and not check_metadata_file(file10), "Existing metadata.jsonl not used"
+	assert check_clean(test_repo_dir), "metadata.jsonl not committed"
+	print("Test 10 passed: Existing store reused")
+
+	# Test 11: Deleting a message drops its record, and the last one drops the store
+	os.remove(file9)
+	run_commit_files(script)
+	assert not check_metadata_store(file9) and check_metadata_store(file10), "Deleted message's record kept"
+	assert check_committed(file9, test_repo_dir) and check_clean(test_repo_dir), "Deletion not committed"
+	os.remove(file10)
+	run_commit_files(f"{script} --plumbing")
+	store_file = os.path.join(os.path.dirname(file10), "metadata.jsonl")
+	assert not os.path.exists(store_file) and check_committed(store_file, test_repo_dir), "Empty store not deleted"
+	assert check_clean(test_repo_dir), "Deletions not committed"
+	print("Test 11 passed: Deleted messages")
+
+	print(f"All --metadata-store tests passed for {script}")
+
 if __name__ == "__main__":
 	scripts = [
 		"python3 commit_files.py",
@@ -89,6 +204,10 @@ if __name__ == "__main__":
 		test_repo_dir = set_up()
 		try:
 			run_tests(f"{script} {test_repo_dir}", test_repo_dir)
+			if script == "python3 commit_files.py":
+				run_plumbing_tests(f"{script} {test_repo_dir}", test_repo_dir)
+				run_sidecar_skip_tests(f"{script} {test_repo_dir}", test_repo_dir)
+				run_metadata_store_tests(f"{script} {test_repo_dir}", test_repo_dir)
 		except:
 			raise
 		finally:
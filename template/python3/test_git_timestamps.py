@@ -0,0 +1,55 @@
+# test_git_timestamps.py
+# to run: python3 test_git_timestamps.py
+
+import os
+import subprocess
+import tempfile
+import git_timestamps
+
+def commit_file(repo_path, relative_path, content, commit_time, amend=False):
+	file_path = os.path.join(repo_path, relative_path)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with open(file_path, 'w') as f:
+		f.write(content)
+	env = dict(os.environ, GIT_AUTHOR_DATE=f"{commit_time} +0000", GIT_COMMITTER_DATE=f"{commit_time} +0000")
+	subprocess.run(["git", "add", relative_path], cwd=repo_path, check=True)
+	subprocess.run(["git", "commit", "-q", "-m", relative_path] + (["--amend"] if amend else []), cwd=repo_path, env=env, check=True)
+
+def run_tests():
+	print("Testing git_timestamps.py")
+
+	with tempfile.TemporaryDirectory() as repo_path:
+		subprocess.run(["git", "init", "-q", repo_path], check=True)
+		subprocess.run(["git", "config", "user.email", "you@example.com"], cwd=repo_path, check=True)
+		subprocess.run(["git", "config", "user.name", "Your Name"], cwd=repo_path, check=True)
+		first = "message/2024-07-18/first.txt"
+		second = "message/2024-07-18/second.txt"
+
+		# Test 1: No commits yet
+		assert git_timestamps.get_commit_times(repo_path) == {}, "Times returned without a HEAD"
+		print("Test 1 passed: Empty repository")
+
+		# Test 2: Each file gets the time of the last commit that touched it
+		commit_file(repo_path, first, "one", 1700000000)
+		commit_file(repo_path, second, "two", 1700000100)
+		commit_file(repo_path, first, "one, edited", 1700000200)
+		times = git_timestamps.get_commit_times(repo_path)
+		assert times == {first: 1700000200, second: 1700000100}, f"Wrong commit times: {times}"
+		assert os.path.exists(git_timestamps.cache_path(repo_path)), "Cache not saved"
+		print("Test 2 passed: Commit times")
+
+		# Test 3: New commits on top of the cached HEAD are read incrementally
+		commit_file(repo_path, second, "two, edited", 1700000300)
+		assert git_timestamps.get_commit_times(repo_path)[second] == 1700000300, "New commit not picked up"
+		print("Test 3 passed: Incremental update")
+
+		# Test 4: A rewritten HEAD rebuilds the map
+		commit_file(repo_path, second, "two, amended", 1700000400, amend=True)
+		times = git_timestamps.get_commit_times(repo_path)
+		assert times == {first: 1700000200, second: 1700000400}, f"Rewritten history not rebuilt: {times}"
+		print("Test 4 passed: Rewritten history")
+
+	print("All tests passed for git_timestamps.py")
+
+if __name__ == "__main__":
+	run_tests()
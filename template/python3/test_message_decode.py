@@ -0,0 +1,41 @@
+# test_message_decode.py
+# to run: python3 test_message_decode.py
+
+import os
+import tempfile
+from message_decode import decode_message, read_message
+
+def run_tests():
+	print("Testing message_decode.py")
+
+	# Test 1: UTF-8 decodes without chardet
+	content, encoding = decode_message("Zoë says hi\n\nAuthor: Zoë".encode('utf-8'))
+	assert encoding == 'utf-8' and content == "Zoë says hi\n\nAuthor: Zoë", "UTF-8 not decoded as UTF-8"
+	print("Test 1 passed: UTF-8")
+
+	# Test 2: Legacy bytes fall back to detection instead of failing
+	raw_data = "Ça me plaît beaucoup, très très bien\n\nAuthor: Zoë".encode('latin-1')
+	content, encoding = decode_message(raw_data)
+	assert encoding != 'utf-8' and "Author: Zo" in content, "Legacy encoding not detected"
+	print("Test 2 passed: Legacy encoding")
+
+	# Test 3: A stale encoding hint doesn't beat UTF-8
+	content, encoding = decode_message("Zoë".encode('utf-8'), 'latin-1')
+	assert encoding == 'utf-8' and content == "Zoë", "Stale encoding hint used for a UTF-8 file"
+	content, encoding = decode_message("Zoë".encode('latin-1'), 'latin-1')
+	assert encoding == 'latin-1' and content == "Zoë", "Encoding hint ignored"
+	print("Test 3 passed: Encoding hints")
+
+	# Test 4: read_message reads the file once and returns its bytes too
+	with tempfile.TemporaryDirectory() as directory:
+		file_path = os.path.join(directory, "message.txt")
+		with open(file_path, 'wb') as f:
+			f.write("hello #world\n\nAuthor: Ann".encode('utf-8'))
+		raw_data, content, encoding = read_message(file_path)
+	assert raw_data == content.encode('utf-8') and encoding == 'utf-8', "read_message returned the wrong data"
+	print("Test 4 passed: read_message")
+
+	print("All tests passed for message_decode.py")
+
+if __name__ == "__main__":
+	run_tests()
@@ -0,0 +1,71 @@
+# test_message_index.py
+# to run: python3 test_message_index.py
+
+import os
+import tempfile
+import message_index
+import metadata_store
+
+def write_message(repo_path, relative_path, content):
+	file_path = os.path.join(repo_path, relative_path)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with open(file_path, 'w', encoding='utf-8') as f:
+		f.write(content)
+	return file_path
+
+def run_tests():
+	print("Testing message_index.py")
+
+	with tempfile.TemporaryDirectory() as repo_path:
+		first = os.path.join("message", "2024-07-18", "first.txt")
+		second = os.path.join("message", "2024-07-18", "second.txt")
+		write_message(repo_path, first, "Hello #world\n\nAuthor: Ann")
+		write_message(repo_path, second, "Second message\n\nauthor: Bob")
+
+		# Test 1: A cold build indexes every file
+		index, changed = message_index.refresh_index(repo_path)
+		entry = index['files'][first]
+		assert changed == 2 and len(index['files']) == 2, "Not every file indexed"
+		assert entry['author'] == "Ann" and entry['hashtags'] == ["#world"] and entry['title'] == "Hello #world", "Wrong fields"
+		assert index['files'][second]['author'] == "Bob", "Author not matched case-insensitively"
+		assert os.path.exists(message_index.index_path(repo_path)), "Index not saved"
+		print("Test 1 passed: Cold build")
+
+		# Test 2: Nothing changed, nothing re-read
+		_, changed = message_index.refresh_index(repo_path)
+		assert changed == 0, "Unchanged files re-indexed"
+		print("Test 2 passed: No changes")
+
+		# Test 3: New, edited and deleted files
+		third = os.path.join("message", "2024-07-19", "third.txt")
+		write_message(repo_path, third, "Third\n\nAuthor: Cy")
+		write_message(repo_path, first, "Hello again #world #again\n\nAuthor: Ann")
+		os.remove(os.path.join(repo_path, second))
+		index, changed = message_index.refresh_index(repo_path)
+		assert changed == 3 and sorted(index['files']) == sorted([first, third]), "Changes not picked up"
+		assert index['files'][first]['hashtags'] == ["#world", "#again"], "Edited file not re-read"
+		print("Test 3 passed: New, edited and deleted files")
+
+		# Test 4: The saved index is used by a fresh process
+		message_index._indexes.clear()
+		_, changed = message_index.refresh_index(repo_path)
+		assert changed == 0, "Saved index not reused"
+		print("Test 4 passed: Saved index")
+
+		# Test 5: Entries come from a metadata.jsonl written after the file
+		fourth = os.path.join("message", "2024-07-20", "fourth.txt")
+		file_path = write_message(repo_path, fourth, "Fourth #stored\n\nAuthor: Dee")
+		os.utime(file_path, (1, 1))
+		metadata_store.update_store(os.path.dirname(file_path), {'fourth.txt': {
+			'author': "Dee", 'title': "From the store", 'hashtags': ["stored"], 'file_hash': "0" * 64}})
+		index, _ = message_index.refresh_index(repo_path)
+		entry = index['files'][fourth]
+		assert entry['title'] == "From the store" and entry['hashtags'] == ["#stored"], "Store not used"
+		print("Test 5 passed: Metadata store")
+
+		assert len(message_index.get_message_index(repo_path)) == 3, "get_message_index returned the wrong entries"
+
+	print("All tests passed for message_index.py")
+
+if __name__ == "__main__":
+	run_tests()
@@ -0,0 +1,57 @@
+# test_metadata_store.py
+# to run: python3 test_metadata_store.py
+
+import os
+import json
+import tempfile
+import metadata_store
+
+def write_sidecar(directory, name, metadata):
+	sidecar_dir = os.path.join(directory, "metadata")
+	os.makedirs(sidecar_dir, exist_ok=True)
+	with open(os.path.join(sidecar_dir, name + ".json"), 'w') as f:
+		json.dump(metadata, f, indent=2)
+
+def run_tests():
+	print("Testing metadata_store.py")
+
+	with tempfile.TemporaryDirectory() as repo_path:
+		day_dir = os.path.join(repo_path, "message", "2024-07-18")
+		os.makedirs(day_dir)
+		first = {'author': "Ann", 'title': "first", 'hashtags': ["#a"], 'file_hash': "0" * 64}
+		second = {'author': "Bob", 'title': "second", 'hashtags': [], 'file_hash': "1" * 64}
+
+		# Test 1: update_store merges records and keeps them sorted by name
+		metadata_store.update_store(day_dir, {'b.txt': second})
+		metadata_store.update_store(day_dir, {'a.txt': first})
+		with open(metadata_store.store_path(day_dir), 'r') as f:
+			names = [json.loads(line)['name'] for line in f]
+		assert names == ['a.txt', 'b.txt'], "Store not merged or not sorted"
+		assert metadata_store.read_store(day_dir) == {'a.txt': first, 'b.txt': second}, "Store doesn't round-trip"
+		print("Test 1 passed: update_store and read_store")
+
+		# Test 2: Unreadable lines are skipped, missing stores are empty
+		with open(metadata_store.store_path(day_dir), 'a') as f:
+			f.write("not json\n")
+		assert metadata_store.read_store(day_dir) == {'a.txt': first, 'b.txt': second}, "Bad line not skipped"
+		assert metadata_store.read_store(os.path.join(repo_path, "message")) == {}, "Missing store not empty"
+		print("Test 2 passed: Bad lines and missing stores")
+
+		# Test 3: migrate folds sidecars into the store and can remove them
+		third = {'author': "Cy", 'title': "third", 'hashtags': ["#c"], 'file_hash': "2" * 64}
+		write_sidecar(day_dir, "c.txt", third)
+		assert metadata_store.migrate(repo_path, remove_sidecars=True) == 1, "Wrong number of sidecars migrated"
+		assert metadata_store.read_store(day_dir)['c.txt'] == third, "Sidecar not migrated"
+		assert not os.path.exists(os.path.join(day_dir, "metadata")), "Sidecars not removed"
+		print("Test 3 passed: migrate")
+
+		# Test 4: export writes sidecars back out
+		assert metadata_store.export(repo_path) == 3, "Wrong number of sidecars exported"
+		with open(os.path.join(day_dir, "metadata", "a.txt.json"), 'r') as f:
+			assert json.load(f) == first, "Exported sidecar differs from the store"
+		print("Test 4 passed: export")
+
+	print("All tests passed for metadata_store.py")
+
+if __name__ == "__main__":
+	run_tests()
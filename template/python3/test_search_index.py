@@ -0,0 +1,54 @@
+# test_search_index.py
+# to run: python3 test_search_index.py
+
+import os
+import tempfile
+import search_index
+
+def write_message(repo_path, name, content, mtime):
+	file_path = os.path.join(repo_path, "message", "2024-07-18", name)
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with open(file_path, 'w', encoding='utf-8') as f:
+		f.write(content)
+	os.utime(file_path, (mtime, mtime))
+	return file_path
+
+def paths(results):
+	return [os.path.basename(result['path']) for result in results]
+
+def run_tests():
+	print("Testing search_index.py")
+
+	with tempfile.TemporaryDirectory() as repo_path:
+		write_message(repo_path, "garden.txt", "Tomatoes in the garden #garden #summer\n\nAuthor: Ann", 1700000000)
+		write_message(repo_path, "kitchen.txt", "Tomato soup recipe #kitchen #summer\n\nAuthor: Bob", 1700000100)
+		removed = write_message(repo_path, "winter.txt", "Snow in the garden #winter\n\nAuthor: ann", 1700000200)
+
+		# Test 1: sync_index indexes every message once
+		assert search_index.sync_index(repo_path) == 3, "Not every message indexed"
+		assert search_index.sync_index(repo_path) == 0, "Unchanged messages re-indexed"
+		print("Test 1 passed: sync_index")
+
+		# Test 2: Words, prefixes, hashtags and authors, newest first
+		assert paths(search_index.search(repo_path, q="garden")) == ["winter.txt", "garden.txt"], "Word search failed"
+		assert paths(search_index.search(repo_path, q="tomato*")) == ["kitchen.txt", "garden.txt"], "Prefix search failed"
+		assert paths(search_index.search(repo_path, tags=["summer"])) == ["kitchen.txt", "garden.txt"], "Hashtag search failed"
+		assert paths(search_index.search(repo_path, tags=["#SUMMER", "#garden"])) == ["garden.txt"], "Hashtags not combined"
+		assert paths(search_index.search(repo_path, author="ANN")) == ["winter.txt", "garden.txt"], "Author search failed"
+		assert paths(search_index.search(repo_path, q="garden", author="Bob")) == [], "Conditions not combined"
+		assert search_index.search(repo_path, q="*") == [] and search_index.search(repo_path, q="...") == [], "Wordless query not empty"
+		assert paths(search_index.search(repo_path, q="*", tags=["kitchen"])) == ["kitchen.txt"], "Wordless query dropped the tag"
+		print("Test 2 passed: search")
+
+		# Test 3: Edited and deleted messages
+		write_message(repo_path, "kitchen.txt", "Pumpkin soup recipe #kitchen #autumn\n\nAuthor: Bob", 1700000300)
+		os.remove(removed)
+		assert search_index.sync_index(repo_path) == 2, "Edit and deletion not synced"
+		assert paths(search_index.search(repo_path, q="tomato*")) == ["garden.txt"], "Edited message still matches old text"
+		assert paths(search_index.search(repo_path, q="snow")) == [], "Deleted message still found"
+		print("Test 3 passed: Edits and deletions")
+
+	print("All tests passed for search_index.py")
+
+if __name__ == "__main__":
+	run_tests()
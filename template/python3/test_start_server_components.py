@@ -0,0 +1,398 @@
+# test_start_server_components.py
+# to run: python3 test_start_server_components.py
+
+# start_server.py's building blocks, tested in-process without starting the full server
+
+import os
+import email.utils
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+import start_server
+
+class EchoHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		self.wfile.write(self.rfile.readline())
+
+def run_server_tests():
+	print("Testing start_server.py server classes")
+
+	# Test 1: Both modes serve connections and stop on shutdown()
+	for server_class in start_server.SERVER_CLASSES.values():
+		httpd = server_class(("127.0.0.1", 0), EchoHandler, workers=2)
+		thread = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True)
+		thread.start()
+		with socket.create_connection(httpd.server_address, timeout=5) as client:
+			client.sendall(b"ping\n")
+			assert client.makefile('rb').readline() == b"ping\n", f"{httpd.mode}: no reply"
+		stop_thread = threading.Thread(target=httpd.shutdown, daemon=True)
+		stop_thread.start()
+		stop_thread.join(5)
+		assert not stop_thread.is_alive(), f"{httpd.mode}: shutdown() didn't return"
+		thread.join(5)
+		assert not thread.is_alive(), f"{httpd.mode}: serve_forever() didn't return"
+		httpd.server_close()
+		assert httpd.status()['handled'] == 1, f"{httpd.mode}: request not counted"
+	print("Test 1 passed: Serve and shut down")
+
+	print("All server class tests passed")
+
+class FakeScripts:
+	"""Stands in for ScriptRegistry: records runs and fails the first `failures[name]` runs of each script"""
+
+	def __init__(self, failures=None):
+		self.failures = dict(failures or {})
+		self.calls = []
+		self.lock = threading.Lock()
+
+	def run(self, script_name, *args):
+		with self.lock:
+			self.calls.append(script_name)
+			failing = self.failures.get(script_name, 0) > 0
+			if failing:
+				self.failures[script_name] -= 1
+		return subprocess.CompletedProcess([script_name, *args], 1 if failing else 0)
+
+	def count(self, script_name):
+		with self.lock:
+			return self.calls.count(script_name)
+
+def wait_until(condition, timeout=5):
+	deadline = time.time() + timeout
+	while not condition():
+		if time.time() > deadline:
+			return False
+		time.sleep(0.02)
+	return True
+
+def run_commit_queue_tests():
+	print("Testing start_server.py CommitQueue")
+
+	# Test 1: A burst of messages becomes one commit, then one push
+	scripts = FakeScripts()
+	pages = start_server.PageGenerator()
+	commit_queue = start_server.CommitQueue(scripts, pages, commit_delay=0.2, push_delay=0.2)
+	for i in range(3):
+		commit_queue.enqueue(f"message/{i}.txt")
+	assert wait_until(lambda: commit_queue.status()['pushes'] == 1), "Batch not committed and pushed"
+	status = commit_queue.status()
+	assert scripts.count('commit_files') == 1 and status['commits'] == 1 and status['committed'] == 3, f"Burst not coalesced: {status}"
+	assert status['pushed'] == 3 and status['unpushed'] == 0 and status['pending'] == 0, f"Wrong counts: {status}"
+	assert pages.generation == 2, "Commit didn't bump the page generation"
+	commit_queue.flush()
+	print("Test 1 passed: Coalesced commit and push")
+
+	# Test 2: A failed commit is counted and neither bumps the pages nor pushes
+	scripts = FakeScripts({'commit_files': 1})
+	pages = start_server.PageGenerator()
+	commit_queue = start_server.CommitQueue(scripts, pages, commit_delay=0.1, push_delay=0.1)
+	commit_queue.enqueue("message/a.txt")
+	assert wait_until(lambda: commit_queue.status()['commit_failures'] == 1), "Commit failure not counted"
+	time.sleep(0.3)
+	status = commit_queue.status()
+	assert status['commits'] == 0 and status['committed'] == 0 and scripts.count('github_update') == 0, f"Failed commit counted as done: {status}"
+	assert pages.generation == 1, "Failed commit bumped the page generation"
+	commit_queue.flush()
+	print("Test 2 passed: Commit failure")
+
+	# Test 3: A failed push is counted and retried
+	scripts = FakeScripts({'github_update': 1})
+	commit_queue = start_server.CommitQueue(scripts, start_server.PageGenerator(), commit_delay=0.1, push_delay=0.1)
+	commit_queue.enqueue("message/a.txt")
+	assert wait_until(lambda: commit_queue.status()['pushes'] == 1), "Failed push not retried"
+	status = commit_queue.status()
+	assert status['push_failures'] == 1 and scripts.count('github_update') == 2 and status['unpushed'] == 0, f"Wrong counts: {status}"
+	commit_queue.flush()
+	print("Test 3 passed: Push retry")
+
+	# Test 4: flush() commits and pushes whatever is queued, on the worker, then stops it
+	scripts = FakeScripts()
+	commit_queue = start_server.CommitQueue(scripts, start_server.PageGenerator(), commit_delay=60, push_delay=60)
+	commit_queue.enqueue("message/a.txt")
+	commit_queue.enqueue("message/b.txt")
+	commit_queue.flush()
+	status = commit_queue.status()
+	assert not commit_queue.thread.is_alive(), "Worker still running after flush()"
+	assert scripts.calls == ['commit_files', 'github_update'], f"Wrong runs on flush: {scripts.calls}"
+	assert status['committed'] == 2 and status['pushed'] == 2, f"Wrong counts after flush: {status}"
+	print("Test 4 passed: flush()")
+
+	print("All CommitQueue tests passed")
+
+def request_handler(headers):
+	"""A request handler with just the request headers, enough for the header logic"""
+	handler = start_server.CustomHTTPRequestHandler.__new__(start_server.CustomHTTPRequestHandler)
+	handler.headers = headers
+	return handler
+
+def run_conditional_get_tests():
+	print("Testing start_server.py conditional GET")
+
+	etag = '"5f3a-1700000000"'
+	mtime = 1700000000.5
+
+	# Test 1: If-None-Match matches the ETag, a weak copy of it, or *
+	assert request_handler({'If-None-Match': etag}).is_not_modified(etag, mtime), "Matching ETag not honoured"
+	assert request_handler({'If-None-Match': f'"other", W/{etag}'}).is_not_modified(etag, mtime), "Weak ETag in a list not honoured"
+	assert request_handler({'If-None-Match': '*'}).is_not_modified(etag, mtime), "* not honoured"
+	assert not request_handler({'If-None-Match': '"other"'}).is_not_modified(etag, mtime), "Different ETag matched"
+	print("Test 1 passed: If-None-Match")
+
+	# Test 2: If-Modified-Since compares whole seconds, and bad dates never match
+	assert request_handler({'If-Modified-Since': email.utils.formatdate(1700000000, usegmt=True)}).is_not_modified(etag, mtime), "Same second counted as modified"
+	assert not request_handler({'If-Modified-Since': email.utils.formatdate(1699999999, usegmt=True)}).is_not_modified(etag, mtime), "Older date not modified"
+	assert not request_handler({'If-Modified-Since': 'yesterday'}).is_not_modified(etag, mtime), "Bad date matched"
+	print("Test 2 passed: If-Modified-Since")
+
+	# Test 3: If-None-Match wins over If-Modified-Since, and no validators means modified
+	assert not request_handler({'If-None-Match': '"other"', 'If-Modified-Since': email.utils.formatdate(1700000000, usegmt=True)}).is_not_modified(etag, mtime), "If-Modified-Since used despite If-None-Match"
+	assert not request_handler({}).is_not_modified(etag, mtime), "Request without validators not modified"
+	print("Test 3 passed: Precedence")
+
+	print("All conditional GET tests passed")
+
+def run_byte_lru_cache_tests():
+	print("Testing start_server.py ByteLRUCache")
+
+	# Test 1: Hits, misses and least-recently-used eviction by total size
+	cache = start_server.ByteLRUCache(10)
+	cache.put('a', b'aaaa')
+	cache.put('b', b'bbbb')
+	assert cache.get('a') == b'aaaa' and cache.get('missing') is None, "Wrong values"
+	cache.put('c', b'cccc')
+	assert cache.get('b') is None and cache.get('a') == b'aaaa' and cache.get('c') == b'cccc', "Least recently used entry not evicted"
+	stats = cache.stats()
+	assert stats == {'entries': 2, 'bytes': 8, 'max_bytes': 10, 'hits': 3, 'misses': 2, 'evictions': 1}, f"Wrong stats: {stats}"
+	print("Test 1 passed: LRU eviction")
+
+	# Test 2: Replacing a value re-counts its size; several small entries can make room for one large one
+	cache.put('a', b'aa')
+	assert cache.stats()['bytes'] == 6, "Replaced value's size not re-counted"
+	cache.put('d', b'dddddddddd')
+	assert cache.stats()['entries'] == 1 and cache.stats()['bytes'] == 10 and cache.stats()['evictions'] == 3, f"Wrong eviction: {cache.stats()}"
+	print("Test 2 passed: Size accounting")
+
+	# Test 3: A value larger than the whole cache isn't stored and evicts nothing
+	cache.put('e', b'e' * 11)
+	assert cache.get('e') is None and cache.get('d') == b'dddddddddd', "Oversized value cached or evicted others"
+	print("Test 3 passed: Oversized values")
+
+	print("All ByteLRUCache tests passed")
+
+def write_script(file_path, content):
+	os.makedirs(os.path.dirname(file_path), exist_ok=True)
+	with open(file_path, 'w') as f:
+		f.write(content)
+
+def run_script_registry_tests():
+	print("Testing start_server.py ScriptRegistry")
+
+	with tempfile.TemporaryDirectory() as directory:
+		python_script = os.path.join(directory, "template", "python3", "hello.py")
+		bash_script = os.path.join(directory, "template", "bash", "hello.sh")
+		write_script(python_script, "print('hello')\n")
+		write_script(bash_script, "exit 3\n")
+
+		# Test 1: Implementations are found and sorted by the preference order
+		scripts = start_server.ScriptRegistry(directory, order=['py', 'sh'])
+		assert scripts.find('hello') == [(python_script, 'py'), (bash_script, 'sh')], f"Wrong implementations: {scripts.find('hello')}"
+		assert scripts.select('hello') == (python_script, 'py'), "Preferred implementation not selected"
+		assert start_server.ScriptRegistry(directory, order=['sh', 'py']).select('hello') == (bash_script, 'sh'), "Order not applied"
+		assert scripts.find('missing') == [] and scripts.select('missing') is None, "Missing script found"
+		print("Test 1 passed: Preference policy")
+
+		# Test 2: round-robin takes turns
+		scripts = start_server.ScriptRegistry(directory, policy='round-robin', order=['py', 'sh'])
+		assert [scripts.select('hello')[1] for _ in range(4)] == ['py', 'sh', 'py', 'sh'], "round-robin didn't alternate"
+		print("Test 2 passed: Round-robin policy")
+
+		# Test 3: fastest tries untimed implementations first, then the lowest average
+		scripts = start_server.ScriptRegistry(directory, policy='fastest', order=['py', 'sh'])
+		scripts.record_time(python_script, 1.0)
+		assert scripts.select('hello') == (bash_script, 'sh'), "Untimed implementation not tried first"
+		scripts.record_time(bash_script, 2.0)
+		scripts.record_time(bash_script, 4.0)
+		assert scripts.average_time(bash_script) == 3.0 and scripts.select('hello') == (python_script, 'py'), "Fastest not selected"
+		print("Test 3 passed: Fastest policy")
+
+		# Test 4: run returns the process and records its time
+		scripts = start_server.ScriptRegistry(directory, order=['sh', 'py'])
+		assert scripts.run('hello').returncode == 3, "Exit status not returned"
+		assert scripts.run('missing') is None, "Missing script ran"
+		assert [entry['path'] for entry in scripts.status()['scripts']['hello']] == [bash_script], "Run time not recorded"
+		print("Test 4 passed: run")
+
+		# Test 5: Added and removed scripts are picked up without restarting
+		added_script = os.path.join(directory, "template", "bash", "added.sh")
+		write_script(added_script, "exit 0\n")
+		assert scripts.find('added') == [(added_script, 'sh')], "Added script not found"
+		os.remove(bash_script)
+		assert scripts.find('hello') == [(python_script, 'py')], "Removed script still found"
+		print("Test 5 passed: Rescan")
+
+	print("All ScriptRegistry tests passed")
+
+class CountingBuild:
+	"""A page build that writes its run number to output_filepath, optionally slowly or failing"""
+
+	def __init__(self, output_filepath, delay=0.0):
+		self.output_filepath = output_filepath
+		self.delay = delay
+		self.fail = False
+		self.lock = threading.Lock()
+		self.builds = 0
+		self.running = 0
+		self.max_running = 0
+
+	def __call__(self):
+		with self.lock:
+			self.running += 1
+			self.max_running = max(self.max_running, self.running)
+		try:
+			time.sleep(self.delay)
+			if self.fail:
+				raise RuntimeError("build failed")
+			with self.lock:
+				self.builds += 1
+				builds = self.builds
+			with open(self.output_filepath, 'w') as f:
+				f.write(str(builds))
+		finally:
+			with self.lock:
+				self.running -= 1
+
+def run_page_generator_tests():
+	print("Testing start_server.py PageGenerator")
+
+	with tempfile.TemporaryDirectory() as directory:
+		output_filepath = os.path.join(directory, "page.html")
+		build = CountingBuild(output_filepath, delay=0.2)
+		pages = start_server.PageGenerator()
+
+		# Test 1: The first request waits for the page, later ones don't rebuild an up-to-date page
+		pages.ensure(output_filepath, build)
+		assert os.path.exists(output_filepath) and build.builds == 1, "First request didn't wait for the build"
+		pages.ensure(output_filepath, build)
+		time.sleep(0.3)
+		assert build.builds == 1, "Up-to-date page rebuilt"
+		print("Test 1 passed: Build once")
+
+		# Test 2: A bump rebuilds in the background; requests meanwhile get the existing copy at once
+		pages.bump()
+		start_time = time.time()
+		pages.ensure(output_filepath, build)
+		assert time.time() - start_time < 0.1, "Request waited for a rebuild despite an existing copy"
+		assert wait_until(lambda: build.builds == 2), "Bump didn't rebuild the page"
+		print("Test 2 passed: Stale-while-revalidate")
+
+		# Test 3: Bumps during a build are coalesced into one more pass, never a concurrent one
+		pages.bump()
+		time.sleep(0.05)
+		for _ in range(5):
+			pages.bump()
+		assert wait_until(lambda: build.builds == 4), "Bumps during a build not rebuilt"
+		time.sleep(0.5)
+		assert build.builds == 4 and build.max_running == 1, f"Bumps not coalesced: {build.builds} builds, {build.max_running} at once"
+		print("Test 3 passed: Single-flight")
+
+		# Test 4: A failed build leaves the page stale, so the next request retries
+		build.fail = True
+		pages.bump()
+		time.sleep(0.4)
+		build.fail = False
+		pages.ensure(output_filepath, build)
+		assert wait_until(lambda: build.builds == 5), "Failed build not retried"
+		print("Test 4 passed: Retry after failure")
+
+	print("All PageGenerator tests passed")
+
+class CountingPages:
+	"""Stands in for PageGenerator, counting bumps"""
+
+	def __init__(self):
+		self.bumps = 0
+
+	def bump(self):
+		self.bumps += 1
+
+def run_message_watcher_tests():
+	print("Testing start_server.py MessageWatcher")
+
+	with tempfile.TemporaryDirectory() as directory:
+		pages = CountingPages()
+		watcher = start_server.MessageWatcher(directory, pages, poll_interval=0.2)
+
+		# Test 1: message/ created after startup is picked up, including files already in it
+		os.makedirs(os.path.join(directory, "message", "2024-01-01"))
+		with open(os.path.join(directory, "message", "2024-01-01", "first.txt"), 'w') as f:
+			f.write("first")
+		assert wait_until(lambda: pages.bumps >= 1), "Message in a new message/ didn't bump"
+		print("Test 1 passed: message/ created after startup")
+
+		# Test 2: later files in the new message/ are watched too
+		bumps = pages.bumps
+		time.sleep(0.5)
+		with open(os.path.join(directory, "message", "2024-01-01", "second.txt"), 'w') as f:
+			f.write("second")
+		assert wait_until(lambda: pages.bumps > bumps), "Second message didn't bump"
+		print("Test 2 passed: Watches added for message/")
+
+		# Test 3: the server's own writes don't bump again
+		bumps = pages.bumps
+		time.sleep(0.5)
+		own_filepath = os.path.join(directory, "message", "2024-01-01", "own.txt")
+		with open(own_filepath, 'w') as f:
+			f.write("own")
+		watcher.written(own_filepath)
+		time.sleep(0.8)
+		assert pages.bumps == bumps, "Server's own write bumped"
+		print("Test 3 passed: Own writes skipped")
+
+	# Test 4: a queue overflow (wd -1, no name) bumps, since the events it stood for are lost
+	with tempfile.TemporaryDirectory() as directory:
+		pages = CountingPages()
+		watcher = start_server.MessageWatcher(directory, pages)
+		if hasattr(watcher, 'fd'):
+			read_fd, write_fd = os.pipe()
+			watcher.fd = read_fd
+			threading.Thread(target=watcher.watch_inotify, daemon=True).start()
+			os.write(write_fd, start_server.struct.pack('iIII', -1, start_server.IN_Q_OVERFLOW, 0, 0))
+			assert wait_until(lambda: pages.bumps == 1), "Queue overflow didn't bump"
+			os.close(write_fd)
+			print("Test 4 passed: Queue overflow")
+
+	print("All MessageWatcher tests passed")
+
+def run_messages_api_tests():
+	print("Testing chat.html.py get_messages cursors")
+
+	get_messages = start_server.load_in_process_renderers(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))['messages']
+	with tempfile.TemporaryDirectory() as directory:
+		# Test 1: An empty archive still gives a cursor, so polling doesn't stay on limit=0
+		result = get_messages(directory, limit=0)
+		assert result == {'messages': [], 'cursor': '0:'}, f"Empty archive gave {result}"
+		print("Test 1 passed: Cursor for an empty archive")
+
+		# Test 2: The first message posted afterwards is returned by the next poll
+		os.makedirs(os.path.join(directory, "message", "2024-01-01"))
+		with open(os.path.join(directory, "message", "2024-01-01", "first.txt"), 'w') as f:
+			f.write("First message\n\nauthor: Ann")
+		result = get_messages(directory, since=result['cursor'])
+		assert [msg['content'] for msg in result['messages']] == ["First message"], f"First message not returned: {result}"
+		assert get_messages(directory, since=result['cursor'])['messages'] == [], "Message returned twice"
+		print("Test 2 passed: First message after an empty archive")
+
+	print("All get_messages cursor tests passed")
+
+if __name__ == "__main__":
+	run_server_tests()
+	run_commit_queue_tests()
+	run_conditional_get_tests()
+	run_byte_lru_cache_tests()
+	run_script_registry_tests()
+	run_page_generator_tests()
+	run_message_watcher_tests()
+	run_messages_api_tests()